@@ -0,0 +1,205 @@
+"""
+=============================================================================
+FOUNDRY AGENT ACCELERATOR - Code Interpreter Formatting
+=============================================================================
+
+This file wraps raw code interpreter output from the agent in markdown
+```python fences, so the chat UI shows it as a code block.
+
+It runs once per line of every agent response, so it is kept in a module
+of its own, free of web framework imports. The Docker image compiles it to
+a C extension with mypyc (see the Dockerfile); Python picks up the
+compiled module automatically and falls back to this file when the
+compiled one isn't there (e.g. when running locally).
+
+Keep the type annotations accurate - mypyc checks them at runtime.
+=============================================================================
+"""
+
+import re
+import string
+
+
+# =============================================================================
+# PRECOMPILED PATTERNS
+# =============================================================================
+
+# Markdown that must never be treated as code
+MARKDOWN_HEADING_PATTERN = re.compile(r'^#{1,6}\s+\S')
+MARKDOWN_IMAGE_PATTERN = re.compile(r'^!\[.*?\]\(.*?\)$')
+MARKDOWN_EMPHASIS_PATTERN = re.compile(r'^(?:\*{1,2}|_{1,2})\w')
+NUMBERED_LIST_PATTERN = re.compile(r'^\d+\.\s+\*{0,2}\w')
+CAPITALIZED_COMMENT_PATTERN = re.compile(r'^#\s+[A-Z][a-z]+')
+
+# Python code patterns
+NAME_START_CHARS = frozenset(string.ascii_lowercase + '_')  # what [a-z_] matches
+METHOD_CALL_PATTERN = re.compile(r'^[a-z_][a-z0-9_]*\.[a-z_]+\(')  # method calls like img.size()
+FUNCTION_CALL_PATTERN = re.compile(r'^[a-z_][a-z0-9_]*\(')  # function calls like print()
+
+# Anything that could make format_code_interpreter_output() see a code line:
+# an '=', a '(' (calls), a /mnt/data/ path, or a line starting with a
+# Python keyword or a common module prefix. Text without any of these is
+# returned unchanged without classifying it line by line.
+POSSIBLE_CODE_PATTERN = re.compile(
+    r"=|\(|/mnt/data/"
+    r"|^\s*(?:import |from |# |def |class |if |for |while |with |try:|except|plt\.|img\.|df\.|np\.|pd\.)",
+    re.MULTILINE,
+)
+
+# Natural language prose patterns
+SENTENCE_START_PATTERN = re.compile(r'^[A-Z][a-z]+.*\s+\w+')
+PROSE_WORD_PATTERN = re.compile(r'(the |is |are |a |an |this |that |hazard|visible|image|worker)', re.IGNORECASE)
+
+
+# =============================================================================
+# LINE CLASSIFIERS
+# =============================================================================
+
+def is_code_line(line: str, in_code_block: bool) -> bool:
+    """
+    Check if a line looks like Python code.
+
+    Args:
+        line: The line to classify
+        in_code_block: Whether the previous line was inside a code block
+
+    Returns:
+        bool: True if the line should be part of a code block
+    """
+    stripped = line.strip()
+    if not stripped:
+        return in_code_block  # Empty lines continue code blocks
+
+    # Each pattern below can only match lines starting with one specific
+    # kind of character, so check that character first - plain string
+    # comparisons are much cheaper than running the regex on every line
+    first = stripped[0]
+
+    # NEVER treat markdown syntax as code
+    # Markdown headings (## Heading)
+    if first == '#' and MARKDOWN_HEADING_PATTERN.match(stripped):
+        return False
+    # Markdown images ![alt](url)
+    if first == '!' and MARKDOWN_IMAGE_PATTERN.match(stripped):
+        return False
+    # Base64 data URIs
+    if 'data:image/' in stripped:
+        return False
+    # Markdown bold/italic at start of line
+    if (first == '*' or first == '_') and MARKDOWN_EMPHASIS_PATTERN.match(stripped):
+        return False
+    # Numbered lists with text (1. **Something**)
+    if first.isdecimal() and NUMBERED_LIST_PATTERN.match(stripped):
+        return False
+
+    # Definite code patterns - must be actual Python code
+    if stripped.startswith(('import ', 'from ')):
+        return True
+    # Python comments start with # followed by space, but exclude markdown headings
+    if stripped.startswith('# ') and not CAPITALIZED_COMMENT_PATTERN.match(stripped):
+        return True
+    if stripped.startswith(('def ', 'class ', 'if ', 'for ', 'while ', 'with ', 'try:', 'except')):
+        return True
+    if '=' in stripped and not stripped.endswith(':') and not stripped.startswith(('**', '*', '-', '•')):
+        return True
+    if stripped.startswith(('plt.', 'img.', 'df.', 'np.', 'pd.')):
+        return True
+    if '/mnt/data/' in stripped:
+        return True
+    if first in NAME_START_CHARS and '(' in stripped:
+        # method calls like img.size() or function calls like print()
+        if METHOD_CALL_PATTERN.match(stripped) or FUNCTION_CALL_PATTERN.match(stripped):
+            return True
+    return False
+
+
+def is_prose_line(line: str) -> bool:
+    """
+    Check if a line looks like natural language prose.
+
+    Args:
+        line: The line to classify
+
+    Returns:
+        bool: True if the line reads like a sentence or a bullet point
+    """
+    stripped = line.strip()
+    if not stripped:
+        return False
+    # Prose typically starts with capital letter and contains spaces/words
+    if stripped[0] in string.ascii_uppercase and SENTENCE_START_PATTERN.match(stripped):
+        # But exclude things that look like code (chained substring tests
+        # run in C, unlike a generator over the characters)
+        if ('(' not in stripped and ')' not in stripped and '=' not in stripped
+                and '.' not in stripped and '/' not in stripped):
+            return True
+        # Check if it's a sentence (ends with punctuation or contains common words)
+        if PROSE_WORD_PATTERN.search(stripped):
+            return True
+    # Bullet points are prose
+    if stripped.startswith(('- ', '* ', '• ')):
+        return True
+    return False
+
+
+# =============================================================================
+# FORMATTER
+# =============================================================================
+
+def format_code_interpreter_output(content: str) -> str:
+    """
+    Detect and wrap raw code interpreter output in markdown code fences.
+
+    Code interpreter output typically starts with import statements and
+    contains Python code that should be formatted nicely in the UI.
+
+    Args:
+        content: The raw response content from the agent
+
+    Returns:
+        str: Content with code interpreter blocks wrapped in ```python fences
+    """
+    # Plain prose responses (the common case) contain nothing that could be
+    # classified as code - skip splitting and classifying them
+    first_candidate = POSSIBLE_CODE_PATTERN.search(content)
+    if not first_candidate:
+        return content
+
+    # No code block can start before the line holding the first candidate,
+    # so everything up to that line is passed through as-is and only the
+    # rest is classified line by line
+    start = content.rfind('\n', 0, first_candidate.start()) + 1
+    head = content[:start]
+    lines = content[start:].split('\n')
+    result_lines: list[str] = []
+    in_code_block = False
+
+    # Lines are written straight to the output: the opening fence goes in
+    # when a code block starts and the closing fence when it ends, so code
+    # lines never have to be collected and copied over separately
+    for line in lines:
+        if in_code_block and is_prose_line(line):
+            # End the code block
+            result_lines.append('```')
+            in_code_block = False
+            result_lines.append(line)
+        elif is_code_line(line, in_code_block):
+            if not in_code_block:
+                result_lines.append('```python')
+                in_code_block = True
+            result_lines.append(line)
+        elif in_code_block and line.strip():
+            # Continue code block with non-empty lines that might be code
+            result_lines.append(line)
+        else:
+            if in_code_block:
+                # End code block on empty line
+                result_lines.append('```')
+                in_code_block = False
+            result_lines.append(line)
+
+    # Close any code block still open at the end
+    if in_code_block:
+        result_lines.append('```')
+
+    return head + '\n'.join(result_lines)
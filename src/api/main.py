@@ -45,58 +45,224 @@ ENVIRONMENT VARIABLES REQUIRED:
 # =============================================================================
 
 # Python standard library imports
-import contextlib  # Helps manage resources that need cleanup
+import asyncio     # For running independent startup work concurrently
+import dataclasses # For the immutable Settings object
+import gzip        # For pre-compressing static assets
 import hashlib     # For computing config hash to detect changes
-import json        # For serializing config to hash
+import inspect     # For checking which route handlers are async
 import logging     # For printing helpful messages to the console
+import mimetypes   # For guessing the content type of static files
 import os          # For reading environment variables (configuration)
-from typing import Union, Any  # For type hints
+import sys         # For passing a failed startup's exception to __aexit__
+import threading   # For guarding the shared token cache
+import time        # For checking token expiry
+from typing import Union, Any, Callable  # For type hints
 from pathlib import Path  # For handling file paths
 
 # Third-party imports
 import yaml  # For parsing agent.yaml configuration
 
+# Use the C-accelerated libyaml loader when PyYAML was built with it,
+# falling back to the pure-Python SafeLoader otherwise. Both parse the
+# same documents; the C version is just much faster.
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 # FastAPI - The web framework that handles HTTP requests
 import fastapi
+from fastapi.concurrency import run_in_threadpool  # Runs blocking SDK calls off the event loop
+from fastapi.routing import APIRoute  # For inspecting registered routes
 from fastapi.staticfiles import StaticFiles  # Serves static files (CSS, images, etc.)
 
+# requests - HTTP library used by the synchronous Azure SDK clients
+import requests
+from urllib3.util.retry import Retry
+
 # Azure AI SDK imports
+# These are deliberately imported at module level even though only the
+# lifespan uses them: gunicorn loads the app once before forking
+# (preload_app), so the import cost is paid once in the master process
+# instead of once per worker.
 from azure.ai.projects import AIProjectClient  # Connects to Azure AI Foundry
-from azure.ai.projects.models import (
-    PromptAgentDefinition,  # For defining agents
-    CodeInterpreterTool,
-    CodeInterpreterToolAuto,
-    BingGroundingAgentTool,
-    BingGroundingSearchToolParameters,
-    BingGroundingSearchConfiguration,
-    AzureAISearchAgentTool,
-    AzureAISearchToolResource,
-    AISearchIndexResource,
-    ImageGenTool,  # For image generation
-    WebSearchPreviewTool,  # For web search (preview)
-)
+from azure.ai.projects.aio import AIProjectClient as AsyncAIProjectClient  # Builds the AsyncOpenAI client
+from azure.ai.projects.models import PromptAgentDefinition  # For defining agents
+
+# Note: The tool classes (CodeInterpreterTool, BingGroundingAgentTool, ...)
+# are imported inside the builder that needs them, so apps that don't
+# enable a tool don't pay to import it.
+
+# OpenAI SDK - The async client streams agent responses without blocking
+# the event loop
+from openai import AsyncOpenAI
 
 # Azure authentication - How we prove our identity to Azure
-from azure.identity import DefaultAzureCredential, AzureCliCredential, ManagedIdentityCredential
+from azure.identity import AzureCliCredential, ManagedIdentityCredential
+from azure.core.credentials import AccessToken  # Token type returned by credentials
+from azure.core.pipeline.transport import RequestsTransport  # HTTP transport for sync clients
+from azure.core.exceptions import AzureError  # Base class for Azure SDK service errors
 
 # dotenv - Loads configuration from .env file during local development
 from dotenv import load_dotenv
 
 # Local imports - Other files in this project
-from .util import get_logger  # Helper for logging messages
+from .util import configure_logger  # Helper for logging messages
+from .util import json_dumps, json_loads  # JSON helpers (use orjson when installed)
+from .util import ResponseCache  # Optional cache of finished chat responses
 
 # =============================================================================
 # GLOBAL VARIABLES
 # =============================================================================
 
-# Logger instance - will be initialized in create_app()
-logger: logging.Logger
+# Logger instance - handlers are attached in create_app()
+logger = logging.getLogger("foundry-agent")
+
+
+# =============================================================================
+# SETTINGS
+# =============================================================================
+# All environment variables are read once, in create_app(), right after the
+# .env file is loaded. The rest of the app reads app.state.settings instead
+# of calling os.getenv() again.
+# =============================================================================
+
+@dataclasses.dataclass(frozen=True)
+class Settings:
+    """
+    Application settings, resolved from environment variables.
+    
+    Attributes:
+        project_endpoint: AZURE_EXISTING_AIPROJECT_ENDPOINT
+        agent_name: AZURE_AI_AGENT_NAME
+        model_name: AZURE_AI_CHAT_DEPLOYMENT_NAME
+        config_source: AGENT_CONFIG_SOURCE ("local" or "portal")
+        running_in_production: Whether RUNNING_IN_PRODUCTION is set
+        client_id: AZURE_CLIENT_ID (managed identity, production only)
+        tenant_id: AZURE_TENANT_ID (Azure CLI tenant, local only)
+        image_generation_deployment: IMAGE_GENERATION_DEPLOYMENT_NAME
+        log_file: APP_LOG_FILE
+        response_cache_size: RESPONSE_CACHE_SIZE (0 disables the cache)
+        attachment_upload_min_size: ATTACHMENT_UPLOAD_MIN_SIZE (0 disables uploads)
+    """
+    project_endpoint: str
+    agent_name: str
+    model_name: str
+    config_source: str
+    running_in_production: bool
+    client_id: str | None
+    tenant_id: str | None
+    image_generation_deployment: str | None
+    log_file: str | None
+    response_cache_size: int
+    attachment_upload_min_size: int
+    
+    @classmethod
+    def from_env(cls) -> "Settings":
+        """
+        Build the settings from the current environment.
+        
+        Raises:
+            RuntimeError: If a required variable is missing
+        """
+        settings = cls(
+            project_endpoint=os.environ.get("AZURE_EXISTING_AIPROJECT_ENDPOINT", ""),
+            agent_name=os.environ.get("AZURE_AI_AGENT_NAME", "foundry-accelerator-agent"),
+            model_name=os.environ.get("AZURE_AI_CHAT_DEPLOYMENT_NAME", ""),
+            config_source=os.environ.get("AGENT_CONFIG_SOURCE", "local").lower(),
+            running_in_production=bool(os.environ.get("RUNNING_IN_PRODUCTION")),
+            client_id=os.environ.get("AZURE_CLIENT_ID"),
+            tenant_id=os.environ.get("AZURE_TENANT_ID"),
+            image_generation_deployment=os.environ.get("IMAGE_GENERATION_DEPLOYMENT_NAME"),
+            log_file=os.environ.get("APP_LOG_FILE"),
+            response_cache_size=int(os.environ.get("RESPONSE_CACHE_SIZE") or 0),
+            attachment_upload_min_size=int(os.environ.get("ATTACHMENT_UPLOAD_MIN_SIZE") or 0),
+        )
+        
+        if not settings.project_endpoint:
+            raise RuntimeError("AZURE_EXISTING_AIPROJECT_ENDPOINT is required")
+        if settings.config_source != "portal" and not settings.model_name:
+            raise RuntimeError("AZURE_AI_CHAT_DEPLOYMENT_NAME is required in local mode")
+        
+        return settings
+
+
+# =============================================================================
+# FILE CACHE
+# =============================================================================
+# The config loaders below are called more than once per process (startup,
+# hash computation, reloads). Parsed results are cached and keyed on the
+# file's modification time and size, so a file is only re-read and
+# re-parsed when it has actually changed on disk.
+# =============================================================================
+
+# Maps file path -> (mtime_ns, size, parsed value)
+_FILE_CACHE: dict[Path, tuple[int, int, Any]] = {}
+
+
+def _load_cached(path: Path, loader: Callable[[Path], Any]) -> Any:
+    """
+    Load a file through `loader`, reusing the cached result if unchanged.
+    
+    Args:
+        path: The file to load
+        loader: Function that reads and parses the file
+        
+    Returns:
+        Any: Whatever `loader` returns for this file
+        
+    Raises:
+        OSError: If the file cannot be stat'ed or read
+    """
+    st = path.stat()
+    cached = _FILE_CACHE.get(path)
+    if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
+    
+    value = loader(path)
+    _FILE_CACHE[path] = (st.st_mtime_ns, st.st_size, value)
+    return value
 
 
 # =============================================================================
 # SYSTEM PROMPT LOADING
 # =============================================================================
 
+# Path to the system prompt file
+SYSTEM_PROMPT_FILE = Path(__file__).parent / "prompts" / "system.txt"
+
+
+# Everything after this marker in system.txt is instructions for humans
+SYSTEM_PROMPT_MARKER = b"====="
+
+# How much of system.txt to read at a time while looking for the marker
+SYSTEM_PROMPT_CHUNK_SIZE = 8 * 1024
+
+# Used when system.txt is missing, empty or unreadable
+DEFAULT_SYSTEM_PROMPT = "You are a helpful assistant."
+
+
+def _read_system_prompt(path: Path) -> str:
+    """
+    Read prompts/system.txt and extract the prompt text.
+    
+    The file is read in chunks and reading stops at the first marker,
+    so the (often long) instruction section below it is never loaded.
+    """
+    buffer = bytearray()
+    with open(path, 'rb') as f:
+        while chunk := f.read(SYSTEM_PROMPT_CHUNK_SIZE):
+            # Start searching a little before the new chunk in case the
+            # marker straddles two chunks
+            search_from = max(0, len(buffer) - len(SYSTEM_PROMPT_MARKER) + 1)
+            buffer += chunk
+            marker_index = buffer.find(SYSTEM_PROMPT_MARKER, search_from)
+            if marker_index != -1:
+                # Extract just the prompt part (before any instruction section)
+                del buffer[marker_index:]
+                break
+    
+    # Normalize Windows line endings like text-mode reads would
+    return buffer.decode('utf-8').replace('\r\n', '\n').strip()
+
+
 def load_system_prompt() -> str:
     """
     Load the system prompt from the prompts/system.txt file.
@@ -105,30 +271,22 @@ def load_system_prompt() -> str:
     By keeping this in a separate file, you can customize the agent
     without modifying Python code.
     
+    The result is memoized in the file cache and only re-read when
+    system.txt changes on disk, so repeated calls cost a single stat().
+    
     Returns:
         str: The contents of prompts/system.txt, or a default prompt
     """
-    prompts_dir = Path(__file__).parent / "prompts"
-    system_prompt_path = prompts_dir / "system.txt"
-    
     try:
-        with open(system_prompt_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-            
-        # Extract just the prompt part (before any instruction section)
-        if '=====' in content:
-            prompt = content.split('=====')[0].strip()
-        else:
-            prompt = content.strip()
-            
-        return prompt if prompt else "You are a helpful assistant."
+        prompt = _load_cached(SYSTEM_PROMPT_FILE, _read_system_prompt)
+        return prompt if prompt else DEFAULT_SYSTEM_PROMPT
             
     except FileNotFoundError:
-        logger.warning(f"System prompt file not found at {system_prompt_path}")
-        return "You are a helpful assistant."
-    except Exception as e:
-        logger.error(f"Error reading system prompt: {e}")
-        return "You are a helpful assistant."
+        logger.warning(f"System prompt file not found at {SYSTEM_PROMPT_FILE}")
+        return DEFAULT_SYSTEM_PROMPT
+    except (OSError, UnicodeDecodeError) as e:
+        logger.error(f"Error reading system prompt: {e}", exc_info=True)
+        return DEFAULT_SYSTEM_PROMPT
 
 
 # =============================================================================
@@ -137,64 +295,167 @@ def load_system_prompt() -> str:
 # We use a hash of the agent configuration to detect changes.
 # This prevents creating a new version on every restart - we only
 # create a new version when the config actually changes.
+#
+# Alongside the hash we store the modification times of the config files.
+# If neither file has been touched since the last deployment, startup can
+# skip reading, parsing and hashing them altogether (the "fast path").
 # =============================================================================
 
-# Path to store the last deployed config hash
+# Path to store the last deployed config state (hash + file mtimes)
 CONFIG_HASH_FILE = Path(__file__).parent / ".agent_config_hash"
 
 
-def compute_config_hash(agent_name: str, model_name: str, instructions: str, tools_config: dict | None = None) -> str:
+# Size of the chunks config files are fed to the hash in
+HASH_CHUNK_SIZE = 64 * 1024
+
+# Separator between hashed fields, so e.g. ("ab", "c") and ("a", "bc")
+# can never produce the same fingerprint
+HASH_FIELD_SEPARATOR = b"\x1f"
+
+
+def _hash_file(h: Any, path: Path) -> None:
+    """Feed a file into a hash in chunks (a missing file adds nothing)."""
+    try:
+        with open(path, 'rb') as f:
+            while chunk := f.read(HASH_CHUNK_SIZE):
+                h.update(chunk)
+    except FileNotFoundError:
+        pass
+
+
+def compute_config_hash(agent_name: str, model_name: str, endpoint: str) -> str:
     """
-    Compute a SHA-256 hash of the agent configuration.
+    Compute a fingerprint of the agent configuration.
     
     This hash is used to detect if the configuration has changed since
     the last deployment. If the hash matches, we skip creating a new version.
     
+    The raw bytes of prompts/system.txt and agent.yaml are streamed into
+    the hash directly (agent.yaml already encodes the tools configuration),
+    so nothing needs to be parsed or re-serialized just to detect a change.
+    
+    The project endpoint is part of the fingerprint, so pointing the app at
+    another Foundry project creates the agent there instead of reusing a
+    version that only exists in the old project.
+    
     Args:
         agent_name: The name of the agent
         model_name: The model deployment name
-        instructions: The system prompt/instructions
-        tools_config: The tools configuration from agent.yaml
+        endpoint: The Azure AI Foundry project endpoint
         
     Returns:
-        str: A hex-encoded SHA-256 hash of the configuration
+        str: A hex-encoded BLAKE2b hash of the configuration
     """
-    config = {
-        "agent_name": agent_name,
-        "model_name": model_name,
-        "instructions": instructions,
-        "tools": tools_config or {},
-    }
-    config_json = json.dumps(config, sort_keys=True)
-    return hashlib.sha256(config_json.encode()).hexdigest()
+    h = hashlib.blake2b(digest_size=16)
+    h.update(agent_name.encode())
+    h.update(HASH_FIELD_SEPARATOR)
+    h.update(model_name.encode())
+    h.update(HASH_FIELD_SEPARATOR)
+    h.update(endpoint.encode())
+    h.update(HASH_FIELD_SEPARATOR)
+    _hash_file(h, SYSTEM_PROMPT_FILE)
+    h.update(HASH_FIELD_SEPARATOR)
+    _hash_file(h, AGENT_CONFIG_FILE)
+    return h.hexdigest()
+
+
+def get_config_file_mtimes() -> tuple[int | None, int | None]:
+    """
+    Get the modification times of prompts/system.txt and agent.yaml.
+    
+    Returns:
+        tuple: (system.txt mtime_ns, agent.yaml mtime_ns), None for a missing file
+    """
+    mtimes = []
+    for path in (SYSTEM_PROMPT_FILE, AGENT_CONFIG_FILE):
+        try:
+            mtimes.append(path.stat().st_mtime_ns)
+        except FileNotFoundError:
+            mtimes.append(None)
+    return mtimes[0], mtimes[1]
 
 
-def get_stored_config_hash() -> str | None:
+def get_stored_config_state() -> dict[str, Any]:
     """
-    Retrieve the previously stored config hash.
+    Retrieve the previously stored config state.
+    
+    The state is a small JSON object:
+    {"hash", "sys_mtime", "yaml_mtime", "endpoint", "agent", "model", "tools", "agent_info"}
     
     Returns:
-        str | None: The stored hash, or None if no hash file exists
+        dict: The stored state, or an empty dict if there is none
     """
     try:
-        if CONFIG_HASH_FILE.exists():
-            return CONFIG_HASH_FILE.read_text().strip()
-    except Exception:
+        # Just try to read it - a missing file is the normal first-run case
+        # and doesn't need a separate exists() check
+        state = json_loads(CONFIG_HASH_FILE.read_bytes())
+        if isinstance(state, dict):
+            return state
+    except FileNotFoundError:
         pass
-    return None
+    except (OSError, ValueError) as e:
+        # ValueError covers corrupt JSON (json and orjson decode errors
+        # both subclass it) - the state is simply rebuilt on the slow path
+        logger.warning(f"Could not read stored config hash: {e}", exc_info=True)
+    return {}
 
 
-def store_config_hash(config_hash: str) -> None:
+def store_config_state(state: dict[str, Any]) -> None:
     """
-    Store the config hash for future comparison.
+    Store the config state for future comparison.
     
     Args:
-        config_hash: The hash to store
+        state: The state to store (see get_stored_config_state)
     """
     try:
-        CONFIG_HASH_FILE.write_text(config_hash)
-    except Exception as e:
-        logger.warning(f"Could not store config hash: {e}")
+        # Write to a temp file and rename it into place, so a crash mid-write
+        # can never leave a truncated file behind (which would force the
+        # slow path and a new agent version on the next startup). Every
+        # worker runs the startup, so each one writes its own temp file.
+        tmp_file = CONFIG_HASH_FILE.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_file, "wb") as f:
+            f.write(json_dumps(state))
+            # Make sure the data is on disk before the rename makes it visible
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, CONFIG_HASH_FILE)
+    except OSError as e:
+        logger.warning(f"Could not store config hash: {e}", exc_info=True)
+
+
+@dataclasses.dataclass(frozen=True)
+class StoredAgent:
+    """
+    The agent fields the app uses, as remembered from the last deployment.
+    
+    When the config is unchanged, this stands in for the agent object
+    returned by agents.get(), so startup needs no round trip to Foundry.
+    """
+    id: str
+    name: str
+    version: str
+    description: str | None = None
+    
+    @classmethod
+    def from_agent(cls, agent: Any) -> "StoredAgent":
+        """Capture the fields of an agent returned by the SDK."""
+        return cls(
+            id=agent.id,
+            name=agent.name,
+            version=getattr(agent, 'version', 'latest'),
+            description=getattr(agent, 'description', None),
+        )
+    
+    @classmethod
+    def from_state(cls, state: dict[str, Any]) -> "StoredAgent | None":
+        """Read the agent stored in a config state, if there is a valid one."""
+        info = state.get("agent_info")
+        if not isinstance(info, dict):
+            return None
+        try:
+            return cls(**info)
+        except TypeError:
+            return None
 
 
 # =============================================================================
@@ -205,6 +466,13 @@ def store_config_hash(config_hash: str) -> None:
 AGENT_CONFIG_FILE = Path(__file__).parent.parent / "agent.yaml"
 
 
+def _read_agent_config(path: Path) -> dict[str, Any]:
+    """Read and parse agent.yaml."""
+    # Pass raw bytes - libyaml detects the encoding and decodes internally
+    config = yaml.load(path.read_bytes(), Loader=YAML_LOADER)
+    return config if config else {}
+
+
 def load_agent_config() -> dict[str, Any]:
     """
     Load the agent configuration from agent.yaml.
@@ -214,358 +482,1067 @@ def load_agent_config() -> dict[str, Any]:
     """
     try:
         if AGENT_CONFIG_FILE.exists():
-            with open(AGENT_CONFIG_FILE, 'r', encoding='utf-8') as f:
-                config = yaml.safe_load(f)
-                return config if config else {}
-    except Exception as e:
-        logger.warning(f"Could not load agent.yaml: {e}")
+            return _load_cached(AGENT_CONFIG_FILE, _read_agent_config)
+    except (OSError, yaml.YAMLError) as e:
+        logger.warning(f"Could not load agent.yaml: {e}", exc_info=True)
     return {}
 
 
-def build_tools(agent_config: dict[str, Any], project_client: AIProjectClient) -> list:
+async def resolve_connections(project_client: AIProjectClient, connection_names: list[str]) -> dict[str, Any]:
     """
-    Build the list of tools based on agent.yaml configuration.
+    Look up project connections by name, all at the same time.
+    
+    Each lookup is a blocking HTTP round trip, so they are run concurrently
+    in the thread pool. Startup then waits for the slowest lookup instead
+    of the sum of all of them.
     
     Args:
-        agent_config: The loaded agent configuration
         project_client: The AIProjectClient for getting connections
+        connection_names: Names of the connections to look up
+        
+    Returns:
+        dict: Connection name -> connection, or the AzureError if the lookup failed
+    """
+    async def get_connection(name: str) -> Any:
+        # Service errors (missing connection, no access, network) disable
+        # the tool; anything else is a bug and should fail startup
+        try:
+            return await run_in_threadpool(project_client.connections.get, name=name)
+        except AzureError as e:
+            return e
+    
+    unique_names = list(dict.fromkeys(connection_names))
+    results = await asyncio.gather(*(get_connection(name) for name in unique_names))
+    return dict(zip(unique_names, results))
+
+
+def _build_code_interpreter(config: dict[str, Any], connections: dict[str, Any], settings: Settings) -> Any:
+    """Code Interpreter - use CodeInterpreterTool with container for PromptAgentDefinition."""
+    from azure.ai.projects.models import CodeInterpreterTool, CodeInterpreterToolAuto
+    
+    logger.info("  📦 Enabling Code Interpreter")
+    return CodeInterpreterTool(container=CodeInterpreterToolAuto())
+
+
+def _build_bing_search(config: dict[str, Any], connections: dict[str, Any], settings: Settings) -> Any:
+    """Bing Search (Web Grounding)."""
+    connection_name = config.get("connection_name")
+    if not connection_name:
+        logger.warning("  ⚠️ Bing Search enabled but no connection_name specified")
+        return None
+    
+    logger.info(f"  🔍 Enabling Bing Search (connection: {connection_name})")
+    connection = connections[connection_name]
+    if isinstance(connection, AzureError):
+        logger.warning(f"  ⚠️ Could not enable Bing Search: {connection}", exc_info=connection)
+        return None
+    
+    from azure.ai.projects.models import (
+        BingGroundingAgentTool,
+        BingGroundingSearchConfiguration,
+        BingGroundingSearchToolParameters,
+    )
+    
+    return BingGroundingAgentTool(
+        bing_grounding=BingGroundingSearchToolParameters(
+            search_configurations=[
+                BingGroundingSearchConfiguration(
+                    project_connection_id=connection.id
+                )
+            ]
+        )
+    )
+
+
+def _build_file_search(config: dict[str, Any], connections: dict[str, Any], settings: Settings) -> Any:
+    """File Search - use dictionary format."""
+    vector_store_name = config.get("vector_store_name")
+    if not vector_store_name:
+        logger.warning("  ⚠️ File Search enabled but no vector_store_name specified")
+        return None
+    
+    logger.info(f"  📄 Enabling File Search (vector store: {vector_store_name})")
+    return {
+        "type": "file_search",
+        "vector_store_ids": [vector_store_name]
+    }
+
+
+def _build_azure_ai_search(config: dict[str, Any], connections: dict[str, Any], settings: Settings) -> Any:
+    """Azure AI Search."""
+    connection_name = config.get("connection_name")
+    index_name = config.get("index_name")
+    if not (connection_name and index_name):
+        logger.warning("  ⚠️ Azure AI Search enabled but missing connection_name or index_name")
+        return None
+    
+    logger.info(f"  🔎 Enabling Azure AI Search (index: {index_name})")
+    connection = connections[connection_name]
+    if isinstance(connection, AzureError):
+        logger.warning(f"  ⚠️ Could not enable Azure AI Search: {connection}", exc_info=connection)
+        return None
+    
+    from azure.ai.projects.models import (
+        AISearchIndexResource,
+        AzureAISearchAgentTool,
+        AzureAISearchToolResource,
+    )
+    
+    return AzureAISearchAgentTool(
+        azure_ai_search=AzureAISearchToolResource(
+            indexes=[
+                AISearchIndexResource(
+                    project_connection_id=connection.id,
+                    index_name=index_name
+                )
+            ]
+        )
+    )
+
+
+def _build_image_generation(config: dict[str, Any], connections: dict[str, Any], settings: Settings) -> Any:
+    """Image Generation (the deployment is also sent as a header with every chat request)."""
+    deployment = settings.image_generation_deployment
+    quality = config.get("quality", "auto")
+    size = config.get("size", "1024x1024")
+    if not deployment:
+        logger.warning("  ⚠️ Image Generation enabled but IMAGE_GENERATION_DEPLOYMENT_NAME not set")
+        return None
+    
+    from azure.ai.projects.models import ImageGenTool
+    
+    logger.info(f"  🎨 Enabling Image Generation (deployment: {deployment}, quality: {quality}, size: {size})")
+    return ImageGenTool(quality=quality, size=size)
+
+
+def _build_web_search(config: dict[str, Any], connections: dict[str, Any], settings: Settings) -> Any:
+    """Web Search (Preview) - uses Grounding with Bing Search."""
+    from azure.ai.projects.models import WebSearchPreviewTool
+    
+    logger.info("  🌐 Enabling Web Search (preview)")
+    return WebSearchPreviewTool()
+
+
+# Maps each agent.yaml tool name to the function that builds it
+TOOL_BUILDERS: dict[str, Callable[[dict[str, Any], dict[str, Any], Settings], Any]] = {
+    "code_interpreter": _build_code_interpreter,
+    "bing_search": _build_bing_search,
+    "file_search": _build_file_search,
+    "azure_ai_search": _build_azure_ai_search,
+    "image_generation": _build_image_generation,
+    "web_search": _build_web_search,
+}
+
+
+async def build_tools(
+    enabled_tools: dict[str, dict[str, Any]],
+    project_client: AIProjectClient,
+    settings: Settings,
+) -> list:
+    """
+    Build the list of tools for the tools enabled in agent.yaml.
+    
+    Args:
+        enabled_tools: The enabled tools, as returned by get_enabled_tools()
+        project_client: The AIProjectClient for getting connections
+        settings: The application settings (e.g. the image deployment)
         
     Returns:
         list: List of tool definitions to pass to create_version
     """
-    tools = []
-    tools_config = agent_config.get("tools", {})
-    
-    # Code Interpreter - use CodeInterpreterTool with container for PromptAgentDefinition
-    code_interpreter = tools_config.get("code_interpreter", {})
-    if code_interpreter.get("enabled", False):
-        logger.info("  📦 Enabling Code Interpreter")
-        tools.append(CodeInterpreterTool(container=CodeInterpreterToolAuto()))
-    
-    # Bing Search (Web Grounding)
-    bing_search = tools_config.get("bing_search", {})
-    if bing_search.get("enabled", False):
-        connection_name = bing_search.get("connection_name")
-        if connection_name:
-            logger.info(f"  🔍 Enabling Bing Search (connection: {connection_name})")
-            # Get connection ID from project
-            try:
-                connection = project_client.connections.get(name=connection_name)
-                tools.append(BingGroundingAgentTool(
-                    bing_grounding=BingGroundingSearchToolParameters(
-                        search_configurations=[
-                            BingGroundingSearchConfiguration(
-                                project_connection_id=connection.id
-                            )
-                        ]
-                    )
-                ))
-            except Exception as e:
-                logger.warning(f"  ⚠️ Could not enable Bing Search: {e}")
-        else:
-            logger.warning("  ⚠️ Bing Search enabled but no connection_name specified")
-    
-    # File Search - use dictionary format
-    file_search = tools_config.get("file_search", {})
-    if file_search.get("enabled", False):
-        vector_store_name = file_search.get("vector_store_name")
-        if vector_store_name:
-            logger.info(f"  📄 Enabling File Search (vector store: {vector_store_name})")
-            tools.append({
-                "type": "file_search",
-                "vector_store_ids": [vector_store_name]
-            })
-        else:
-            logger.warning("  ⚠️ File Search enabled but no vector_store_name specified")
-    
-    # Azure AI Search
-    azure_ai_search = tools_config.get("azure_ai_search", {})
-    if azure_ai_search.get("enabled", False):
-        connection_name = azure_ai_search.get("connection_name")
-        index_name = azure_ai_search.get("index_name")
-        if connection_name and index_name:
-            logger.info(f"  🔎 Enabling Azure AI Search (index: {index_name})")
-            try:
-                connection = project_client.connections.get(name=connection_name)
-                tools.append(AzureAISearchAgentTool(
-                    azure_ai_search=AzureAISearchToolResource(
-                        indexes=[
-                            AISearchIndexResource(
-                                project_connection_id=connection.id,
-                                index_name=index_name
-                            )
-                        ]
-                    )
-                ))
-            except Exception as e:
-                logger.warning(f"  ⚠️ Could not enable Azure AI Search: {e}")
-        else:
-            logger.warning("  ⚠️ Azure AI Search enabled but missing connection_name or index_name")
-    
-    # Image Generation
-    image_gen = tools_config.get("image_generation", {})
-    if image_gen.get("enabled", False):
-        deployment = os.environ.get("IMAGE_GENERATION_DEPLOYMENT_NAME")
-        quality = image_gen.get("quality", "auto")
-        size = image_gen.get("size", "1024x1024")
-        if deployment:
-            logger.info(f"  🎨 Enabling Image Generation (deployment: {deployment}, quality: {quality}, size: {size})")
-            tools.append(ImageGenTool(quality=quality, size=size))
-        else:
-            logger.warning("  ⚠️ Image Generation enabled but IMAGE_GENERATION_DEPLOYMENT_NAME not set")
+    # Resolve all the connections the enabled tools need up front
+    connection_names = [
+        config["connection_name"] for config in enabled_tools.values()
+        if config.get("connection_name")
+    ]
+    connections = await resolve_connections(project_client, connection_names)
     
-    # Web Search (Preview) - uses Grounding with Bing Search
-    web_search = tools_config.get("web_search", {})
-    if web_search.get("enabled", False):
-        logger.info("  🌐 Enabling Web Search (preview)")
-        tools.append(WebSearchPreviewTool())
+    tools = []
+    for tool_name, config in enabled_tools.items():
+        builder = TOOL_BUILDERS.get(tool_name)
+        if builder is None:
+            logger.warning(f"  ⚠️ Unknown tool '{tool_name}' in agent.yaml - skipping")
+            continue
+        tool = builder(config, connections, settings)
+        if tool is not None:
+            tools.append(tool)
     
     return tools
 
 
-def get_tools_config_for_hash(agent_config: dict[str, Any]) -> dict:
+def get_enabled_tools(agent_config: dict[str, Any]) -> dict[str, dict[str, Any]]:
     """
-    Extract just the tools configuration for hashing.
+    Extract the enabled tools from the agent configuration.
     
-    We need a stable representation for the hash computation.
+    This single pass over the tools section is shared by the startup
+    logging and build_tools().
     
     Args:
         agent_config: The loaded agent configuration
         
     Returns:
-        dict: Tools configuration suitable for hashing
+        dict: Tool name -> tool configuration, for enabled tools only
     """
-    return agent_config.get("tools", {})
+    tools_config = agent_config.get("tools") or {}
+    return {
+        name: config for name, config in tools_config.items()
+        if isinstance(config, dict) and config.get("enabled")
+    }
 
 
 # =============================================================================
-# APPLICATION LIFESPAN
+# STATIC FILES
+# =============================================================================
+# In production the static assets (the built React app, CSS, images) never
+# change while the app is running, so they are read into memory once at
+# startup. Serving them is then a dict lookup instead of a stat + open +
+# read on every request.
 # =============================================================================
 
-@contextlib.asynccontextmanager
-async def lifespan(app: fastapi.FastAPI):
+# Directory containing the static assets (relative to src/)
+STATIC_DIR = Path("api/static")
+
+# Text-based assets are also kept gzip-compressed (once, at startup) and
+# served compressed to browsers that accept it
+COMPRESSIBLE_MEDIA_TYPES = {"application/javascript", "application/json", "image/svg+xml", "text/javascript"}
+
+# Files smaller than this aren't worth compressing
+GZIP_MIN_SIZE = 1024
+
+
+def _is_compressible(media_type: str) -> bool:
+    """Check whether an asset of this media type benefits from gzip."""
+    return media_type.startswith("text/") or media_type in COMPRESSIBLE_MEDIA_TYPES
+
+
+def _accepts_gzip(accept_encoding: str) -> bool:
     """
-    Application lifespan manager - runs on startup and shutdown.
+    Check whether an Accept-Encoding header allows a gzip response.
     
-    STARTUP (before yield):
-    - Sets up Azure credentials
-    - Connects to Azure AI Foundry
-    - Creates or updates the persistent AI Agent
+    Honors q-values, so "gzip;q=0" (or "*;q=0" without a gzip entry)
+    refuses gzip. An explicit gzip entry takes precedence over "*".
+    """
+    wildcard_q = None
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        if coding not in ("gzip", "*"):
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding == "gzip":
+            return q > 0
+        wildcard_q = q
+    return wildcard_q is not None and wildcard_q > 0
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    Check an If-None-Match header against an asset's ETag.
     
-    SHUTDOWN (after yield):
-    - Closes all connections cleanly
+    The header may list several ETags or be "*". If-None-Match uses weak
+    comparison, so a W/ prefix is ignored.
+    """
+    if if_none_match.strip() == "*":
+        return True
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def preload_static_files(directory: Path) -> dict[str, tuple[bytes, bytes | None, str, str]]:
     """
+    Read every file under `directory` into memory.
     
-    # -------------------------------------------------------------------------
-    # STEP 1: SET UP AZURE CREDENTIALS
-    # -------------------------------------------------------------------------
+    Args:
+        directory: The static files directory
+        
+    Returns:
+        dict: Relative path -> (content, gzipped content or None, media type, ETag)
+    """
+    assets = {}
+    for path in directory.rglob("*"):
+        if not path.is_file():
+            continue
+        content = path.read_bytes()
+        media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        etag = '"' + hashlib.blake2b(content, digest_size=16).hexdigest() + '"'
+        
+        gzipped = None
+        if len(content) >= GZIP_MIN_SIZE and _is_compressible(media_type):
+            # mtime=0 keeps the output identical across workers and restarts
+            gzipped = gzip.compress(content, compresslevel=9, mtime=0)
+            if len(gzipped) >= len(content):
+                gzipped = None
+        
+        assets[path.relative_to(directory).as_posix()] = (content, gzipped, media_type, etag)
+    return assets
+
+
+def add_preloaded_static_route(app: fastapi.FastAPI, static_files: StaticFiles) -> None:
+    """
+    Serve /static from memory, falling back to `static_files` for misses.
     
-    logger.info("=" * 60)
-    logger.info("STARTING FOUNDRY AGENT ACCELERATOR")
-    logger.info("=" * 60)
+    The asset file names are not content-hashed (e.g. main-react-app.js),
+    so browsers are told to revalidate with the ETag rather than cache
+    forever. Unchanged files then cost a tiny 304 response, and text
+    assets are sent pre-compressed when the browser accepts gzip.
     
-    azure_credential: Union[AzureCliCredential, ManagedIdentityCredential]
+    Args:
+        app: The FastAPI application
+        static_files: The StaticFiles app to fall back to
+    """
+    assets = preload_static_files(STATIC_DIR)
+    logger.info(f"Preloaded {len(assets)} static file(s) into memory")
     
-    if not os.getenv("RUNNING_IN_PRODUCTION"):
-        # LOCAL DEVELOPMENT MODE
-        logger.info("Running in LOCAL DEVELOPMENT mode")
+    @app.api_route("/static/{file_path:path}", methods=["GET", "HEAD"], include_in_schema=False)
+    async def serve_static(file_path: str, request: fastapi.Request) -> fastapi.Response:
+        asset = assets.get(file_path)
+        if asset is None:
+            return await static_files.get_response(file_path, request.scope)
         
-        if tenant_id := os.getenv("AZURE_TENANT_ID"):
-            logger.info(f"Using AzureCliCredential with tenant_id: {tenant_id}")
-            azure_credential = AzureCliCredential(tenant_id=tenant_id)
-        else:
-            logger.info("Using AzureCliCredential (default tenant)")
-            azure_credential = AzureCliCredential()
-    else:
-        # PRODUCTION MODE (running in Azure)
-        logger.info("Running in PRODUCTION mode (Azure)")
-        user_identity_client_id = os.getenv("AZURE_CLIENT_ID")
-        logger.info(f"Using ManagedIdentityCredential with client_id: {user_identity_client_id}")
-        azure_credential = ManagedIdentityCredential(client_id=user_identity_client_id)
-    
-    # -------------------------------------------------------------------------
-    # STEP 2: CONNECT TO AZURE AI FOUNDRY PROJECT
-    # -------------------------------------------------------------------------
+        content, gzipped, media_type, etag = asset
+        headers = {"Cache-Control": "no-cache"}
+        
+        if gzipped is not None:
+            headers["Vary"] = "Accept-Encoding"
+            if _accepts_gzip(request.headers.get("accept-encoding", "")):
+                # The compressed bytes are a different representation, so
+                # they get their own ETag
+                content = gzipped
+                etag = etag[:-1] + '-gzip"'
+                headers["Content-Encoding"] = "gzip"
+        
+        headers["ETag"] = etag
+        if _etag_matches(request.headers.get("if-none-match", ""), etag):
+            return fastapi.Response(status_code=304, headers=headers)
+        return fastapi.Response(content=content, media_type=media_type, headers=headers)
+
+
+# =============================================================================
+# HTTP CONNECTION POOL
+# =============================================================================
+# AIProjectClient is synchronous, so its HTTP traffic goes through a
+# `requests` session. We create that session ourselves so the pool is sized
+# for the concurrent lookups done at startup (see resolve_connections) and
+# connections stay alive for the whole life of the worker.
+# =============================================================================
+
+# Maximum number of pooled keep-alive connections per host
+HTTP_POOL_MAXSIZE = 32
+
+
+def create_http_session() -> requests.Session:
+    """
+    Create the pooled HTTP session shared by all AIProjectClient operations.
     
-    endpoint = os.environ["AZURE_EXISTING_AIPROJECT_ENDPOINT"]
-    logger.info(f"Connecting to Azure AI Foundry project: {endpoint}")
+    Mirrors the session azure-core builds by default (retries are left to
+    the SDK's own retry policy), but with a larger connection pool.
     
-    # Create the project client - this is our main connection to Foundry
-    project_client = AIProjectClient(
-        credential=azure_credential,
-        endpoint=endpoint,
+    Returns:
+        requests.Session: A session to pass to RequestsTransport
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=HTTP_POOL_MAXSIZE,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        max_retries=Retry(total=False, redirect=False, raise_on_status=False),
     )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# =============================================================================
+# AZURE CREDENTIALS
+# =============================================================================
+# Every Azure SDK pipeline (agents, connections, the OpenAI client) asks the
+# credential for a token on its own. For AzureCliCredential each of those
+# calls spawns an `az` subprocess, so the credential is wrapped in a small
+# cache that hands out the same token until it is about to expire.
+# =============================================================================
+
+# Refresh a cached token when it has less than this many seconds left
+TOKEN_REFRESH_MARGIN_SECONDS = 30
+
+
+class CachingTokenCredential:
+    """
+    Wraps a credential and caches its access tokens until shortly before expiry.
     
-    # -------------------------------------------------------------------------
-    # STEP 3: CONNECT TO OR CREATE AGENT (BASED ON CONFIG SOURCE)
-    # -------------------------------------------------------------------------
-    # Two modes are supported:
-    # - LOCAL: Agent is configured via prompts/system.txt and agent.yaml
-    # - PORTAL: Agent is configured entirely in Azure AI Foundry portal
-    # -------------------------------------------------------------------------
+    Tokens are cached per (scopes, tenant_id). Requests carrying `claims`
+    (a Continuous Access Evaluation challenge) always go to the wrapped
+    credential, since the cached token was just rejected.
+    """
     
-    agent_name = os.environ.get("AZURE_AI_AGENT_NAME", "foundry-accelerator-agent")
-    model_name = os.environ.get("AZURE_AI_CHAT_DEPLOYMENT_NAME", "")
-    config_source = os.environ.get("AGENT_CONFIG_SOURCE", "local").lower()
+    def __init__(self, inner: Union[AzureCliCredential, ManagedIdentityCredential]):
+        self._inner = inner
+        self._tokens: dict[tuple[Any, ...], AccessToken] = {}
+        # One lock for all refreshes, so concurrent callers wait for a single
+        # `az` call instead of each starting their own
+        self._lock = threading.Lock()
     
-    logger.info("-" * 60)
+    def get_cached_token(self, *scopes: str) -> AccessToken | None:
+        """Return a still-valid cached token without ever blocking, or None."""
+        token = self._tokens.get((scopes, None))
+        if token is not None and token.expires_on - time.time() > TOKEN_REFRESH_MARGIN_SECONDS:
+            return token
+        return None
     
-    if config_source == "portal":
-        # ---------------------------------------------------------------------
-        # PORTAL MODE: Agent is managed in Azure AI Foundry portal
-        # ---------------------------------------------------------------------
-        logger.info("CONFIG MODE: PORTAL")
-        logger.info("-" * 60)
-        logger.info("Agent configuration is managed in Azure AI Foundry portal.")
-        logger.info("Local files (prompts/system.txt, agent.yaml) are IGNORED.")
-        logger.info("Changes made in the portal take effect immediately.")
-        logger.info("-" * 60)
+    def get_token(self, *scopes: str, **kwargs: Any) -> AccessToken:
+        if kwargs.get("claims"):
+            return self._inner.get_token(*scopes, **kwargs)
         
-        logger.info(f"Connecting to agent: {agent_name}")
+        key = (scopes, kwargs.get("tenant_id"))
+        token = self._tokens.get(key)
+        if token is not None and token.expires_on - time.time() > TOKEN_REFRESH_MARGIN_SECONDS:
+            return token
         
-        # In portal mode, tools are managed in the portal, not locally
-        tools_config = {}
-        
-        try:
-            agent = project_client.agents.get(agent_name)
-            agent_version = getattr(agent, 'version', 'latest')
-            logger.info(f"✅ Connected to agent: {agent.name} (v{agent_version})")
-        except Exception as e:
-            logger.error(f"❌ Could not find agent '{agent_name}' in Foundry!")
-            logger.error("   Create the agent in the Azure AI Foundry portal first,")
-            logger.error("   or switch to local mode by setting AGENT_CONFIG_SOURCE=local")
-            raise RuntimeError(f"Agent '{agent_name}' not found in Foundry: {e}")
-    
-    else:
-        # ---------------------------------------------------------------------
-        # LOCAL MODE: Agent is managed via local config files
-        # ---------------------------------------------------------------------
-        logger.info("CONFIG MODE: LOCAL")
-        logger.info("-" * 60)
-        logger.info("Agent configuration is managed via local files:")
-        logger.info("  • prompts/system.txt - Agent instructions")
-        logger.info("  • agent.yaml - Tool configuration")
-        logger.info("Portal changes will be OVERWRITTEN on restart.")
-        logger.info("-" * 60)
-        
-        if not model_name:
-            raise RuntimeError("AZURE_AI_CHAT_DEPLOYMENT_NAME is required in local mode")
+        with self._lock:
+            # Another thread may have refreshed the token while we waited
+            token = self._tokens.get(key)
+            if token is None or token.expires_on - time.time() <= TOKEN_REFRESH_MARGIN_SECONDS:
+                token = self._inner.get_token(*scopes, **kwargs)
+                self._tokens[key] = token
+            return token
+    
+    def close(self) -> None:
+        self._inner.close()
+
+
+def select_credential_factory(settings: Settings) -> Callable[[], CachingTokenCredential]:
+    """
+    Decide once which Azure credential the app should use.
+    
+    Called from create_app() after the .env file has been loaded, so the
+    environment is only inspected a single time.
+    
+    - Local development: AzureCliCredential (uses your `az login` session)
+    - Production (RUNNING_IN_PRODUCTION set): ManagedIdentityCredential
+    
+    Args:
+        settings: The application settings
         
-        # Load configuration from local files
-        system_prompt = load_system_prompt()
-        agent_config = load_agent_config()
-        tools_config = get_tools_config_for_hash(agent_config)
-        
-        # Compute hash of current config (including tools)
-        current_hash = compute_config_hash(agent_name, model_name, system_prompt, tools_config)
-        stored_hash = get_stored_config_hash()
-        
-        logger.info("AGENT CONFIGURATION:")
-        logger.info(f"  Agent Name: {agent_name}")
-        logger.info(f"  Model: {model_name}")
-        logger.info(f"  Instructions: {system_prompt[:80]}...")
-        logger.info(f"  Config Hash: {current_hash[:16]}...")
-        
-        # Log enabled tools
-        enabled_tools = [k for k, v in tools_config.items() if isinstance(v, dict) and v.get("enabled")]
-        if enabled_tools:
-            logger.info(f"  Tools: {', '.join(enabled_tools)}")
-        else:
-            logger.info("  Tools: None")
+    Returns:
+        Callable: A function that creates the chosen credential
+    """
+    if settings.running_in_production:
+        # PRODUCTION MODE (running in Azure)
+        user_identity_client_id = settings.client_id
         
-        logger.info("-" * 40)
+        def create_managed_identity_credential() -> CachingTokenCredential:
+            logger.info("Running in PRODUCTION mode (Azure)")
+            logger.info(f"Using ManagedIdentityCredential with client_id: {user_identity_client_id}")
+            return CachingTokenCredential(ManagedIdentityCredential(client_id=user_identity_client_id))
         
-        if current_hash == stored_hash:
-            # Config unchanged - retrieve existing agent
-            logger.info("✅ Config unchanged - using existing agent version")
-            agent = project_client.agents.get(agent_name)
-            agent_version = getattr(agent, 'version', 'latest')
-            logger.info(f"   Retrieved: {agent.name} (v{agent_version})")
-        else:
-            # Config changed - create new version
-            if stored_hash:
-                logger.info("📝 Config changed - creating new agent version")
-            else:
-                logger.info("📝 First deployment - creating agent")
-            
-            # Build tools from agent.yaml
-            logger.info("Building tools...")
-            tools = build_tools(agent_config, project_client)
-            
-            # Create the agent with tools
-            agent = project_client.agents.create_version(
-                agent_name=agent_name,
-                definition=PromptAgentDefinition(
-                    model=model_name,
-                    instructions=system_prompt,
-                    tools=tools if tools else None,
-                ),
-                description="Agent created/updated by Foundry Agent Accelerator",
-            )
-            
-            # Store the new hash
-            store_config_hash(current_hash)
-            
-            logger.info(f"✅ New version created!")
-            logger.info(f"   ID: {agent.id}")
-            logger.info(f"   Name: {agent.name}")
-            logger.info(f"   Version: {agent.version}")
+        return create_managed_identity_credential
     
-    # -------------------------------------------------------------------------
-    # STEP 4: GET THE OPENAI CLIENT FOR CHAT
-    # -------------------------------------------------------------------------
-    # The OpenAI client is used to interact with the agent via the
-    # responses API, which supports streaming.
-    # -------------------------------------------------------------------------
+    # LOCAL DEVELOPMENT MODE
+    tenant_id = settings.tenant_id
     
-    openai_client = project_client.get_openai_client()
+    def create_cli_credential() -> CachingTokenCredential:
+        logger.info("Running in LOCAL DEVELOPMENT mode")
+        if tenant_id:
+            logger.info(f"Using AzureCliCredential with tenant_id: {tenant_id}")
+            return CachingTokenCredential(AzureCliCredential(tenant_id=tenant_id))
+        logger.info("Using AzureCliCredential (default tenant)")
+        return CachingTokenCredential(AzureCliCredential())
     
-    # -------------------------------------------------------------------------
-    # STEP 5: STORE CLIENTS IN APP STATE
-    # -------------------------------------------------------------------------
+    return create_cli_credential
+
+
+# =============================================================================
+# ASYNC OPENAI CLIENT
+# =============================================================================
+# project_client.get_openai_client() returns a synchronous OpenAI client,
+# whose streaming iterator would block the event loop for the whole agent
+# turn. The chat route uses the AsyncOpenAI client from the SDK's async
+# AIProjectClient instead, so the base URL, API version and token scope
+# always match what the installed SDK uses.
+# =============================================================================
+
+class AsyncCachingTokenCredential:
+    """
+    Exposes a CachingTokenCredential to async Azure SDK clients.
+    
+    Cached tokens are returned right away; only a refresh (an `az` call or
+    a managed identity request) runs in the thread pool. The wrapped
+    credential is owned (and closed) by the lifespan, not by this adapter.
+    """
+    
+    def __init__(self, inner: CachingTokenCredential):
+        self._inner = inner
+    
+    async def get_token(self, *scopes: str, **kwargs: Any) -> AccessToken:
+        if not kwargs:
+            token = self._inner.get_cached_token(*scopes)
+            if token is not None:
+                return token
+        return await run_in_threadpool(self._inner.get_token, *scopes, **kwargs)
+    
+    async def close(self) -> None:
+        pass
     
-    app.state.project_client = project_client
-    app.state.openai_client = openai_client
-    app.state.agent = agent
-    app.state.agent_name = agent_name
+    async def __aenter__(self) -> "AsyncCachingTokenCredential":
+        return self
     
-    # Store image generation deployment name if enabled (needed for extra_headers)
-    image_gen_config = tools_config.get("image_generation", {})
-    if image_gen_config.get("enabled", False):
-        app.state.image_generation_deployment = os.environ.get("IMAGE_GENERATION_DEPLOYMENT_NAME")
-    else:
-        app.state.image_generation_deployment = None
+    async def __aexit__(self, *args: Any) -> None:
+        pass
+
+
+async def create_async_openai_client(credential: CachingTokenCredential, endpoint: str) -> AsyncOpenAI:
+    """
+    Create an authenticated AsyncOpenAI client for the Foundry project.
+    
+    The async project client is only needed to build the OpenAI client, so
+    it is closed again right away; the OpenAI client keeps working on its
+    own HTTP connection pool.
+    
+    Args:
+        credential: The (caching) Azure credential used for the project client
+        endpoint: The Azure AI Foundry project endpoint
+        
+    Returns:
+        AsyncOpenAI: A client for the project's OpenAI-compatible endpoint
+    """
+    async with AsyncAIProjectClient(
+        endpoint=endpoint,
+        credential=AsyncCachingTokenCredential(credential),
+    ) as async_project_client:
+        return await async_project_client.get_openai_client()
+
+
+# =============================================================================
+# APPLICATION LIFESPAN
+# =============================================================================
+
+# How many uploaded attachment ids each worker remembers
+UPLOADED_FILES_CACHE_SIZE = 256
+
+
+@dataclasses.dataclass(slots=True)
+class AppContext:
+    """
+    Everything the routes need from startup, stored as app.state.ctx.
     
+    Routes make one lookup on Starlette's dict-backed app.state and then
+    read plain slots. Not frozen, because the agent may only be filled in
+    after startup (see fetch_agent).
+    
+    The extra headers and body passed with every responses.create() call
+    depend only on the deployment settings and the agent, so they are
+    built here once instead of on every chat request.
+    """
+    project_client: AIProjectClient
+    openai_client: AsyncOpenAI
+    agent_name: str
+    chat_extra_headers: dict[str, str] | None = None
+    chat_extra_body: dict[str, Any] | None = None
+    response_cache: ResponseCache | None = None
+    uploaded_files: ResponseCache | None = None
+    attachment_upload_min_size: int = 0
+    agent: Any = None
+    agent_version: str | None = None
+    agent_task: asyncio.Task | None = None
+    agent_state: dict[str, Any] | None = None
+    
+    def start_agent_fetch(self, state: dict[str, Any]) -> None:
+        """
+        Retrieve the agent in a background task (see fetch_agent).
+        
+        Args:
+            state: Config state to store together with the retrieved agent
+        """
+        # Kept so resolve_agent() can start over if this attempt fails
+        self.agent_state = state
+        self.agent_task = asyncio.create_task(fetch_agent(self, state))
+    
+    async def resolve_agent(self) -> Any:
+        """
+        Return the agent, waiting for the background fetch if needed.
+        
+        A failed fetch is not kept around: the request that finds it failed
+        starts a new attempt, so a transient Foundry error at startup does
+        not leave the server answering every request with that error.
+        
+        Returns:
+            The agent
+        """
+        if self.agent is not None:
+            return self.agent
+        task = self.agent_task
+        if task.done() and (task.cancelled() or task.exception() is not None):
+            logger.info(f"🔄 Retrying to retrieve agent '{self.agent_name}'")
+            self.start_agent_fetch(self.agent_state)
+            task = self.agent_task
+        return await task
+
+
+def publish_agent(ctx: AppContext, agent: Any) -> None:
+    """
+    Make a resolved agent available to the routes.
+    
+    Args:
+        ctx: The application context
+        agent: The agent returned by agents.get() or agents.create_version()
+    """
+    # Resolve the agent version once (some agent objects don't carry one)
     agent_version = getattr(agent, 'version', 'latest')
+    
+    ctx.agent = agent
+    ctx.agent_version = agent_version
+    # Routes chat requests to this agent (see chat_stream_handler)
+    ctx.chat_extra_body = {
+        "agent": {
+            "name": agent.name,
+            "type": "agent_reference"
+        }
+    }
+    
     logger.info("=" * 60)
     logger.info(f"AGENT READY - {agent.name} (v{agent_version})")
     logger.info("Agent is visible in Azure AI Foundry portal!")
     logger.info("=" * 60)
+
+
+async def fetch_agent(ctx: AppContext, state: dict[str, Any]) -> Any:
+    """
+    Retrieve the existing agent version from Foundry in the background.
     
-    # -------------------------------------------------------------------------
-    # YIELD - Application runs here
-    # -------------------------------------------------------------------------
+    When the config is unchanged, the only thing startup would wait for is
+    this agents.get() round trip. Running it as a task lets the server
+    start accepting requests right away; the first request that needs the
+    agent awaits the task (see get_agent in routes.py).
+    
+    Args:
+        ctx: The application context (provides the client and agent name)
+        state: Config state to store together with the retrieved agent, so
+            the next unchanged restart can skip this call
+        
+    Returns:
+        The retrieved agent
+    """
+    try:
+        agent = await run_in_threadpool(ctx.project_client.agents.get, ctx.agent_name)
+    except AzureError:
+        logger.error(
+            f"❌ Could not retrieve agent '{ctx.agent_name}' from Foundry (retrying on the next request)",
+            exc_info=True,
+        )
+        raise
+    logger.info(f"   Retrieved: {agent.name}")
+    publish_agent(ctx, agent)
+    await run_in_threadpool(
+        store_config_state,
+        {**state, "agent_info": dataclasses.asdict(StoredAgent.from_agent(agent))},
+    )
+    return agent
+
+
+class Lifespan:
+    """
+    Application lifespan manager - runs on startup and shutdown.
+        
+    FastAPI creates one per application run and uses it as an async
+    context manager:
+        
+    STARTUP (__aenter__):
+    - Sets up Azure credentials
+    - Connects to Azure AI Foundry
+    - Creates or updates the persistent AI Agent
+        
+    SHUTDOWN (__aexit__):
+    - Closes all connections cleanly
     
-    yield
+    Every resource is kept on the instance as soon as it is created, so a
+    startup that fails halfway can still close what it opened.
+    """
     
-    # -------------------------------------------------------------------------
-    # SHUTDOWN: CLEAN UP RESOURCES
-    # -------------------------------------------------------------------------
+    def __init__(self, app: fastapi.FastAPI):
+        self.app = app
+        self.ctx: AppContext | None = None
+        self.config_state_task: asyncio.Future | None = None
+        self.credential: CachingTokenCredential | None = None
+        self.http_session: requests.Session | None = None
+        self.project_client: AIProjectClient | None = None
+        self.openai_client: AsyncOpenAI | None = None
+    
+    async def __aenter__(self) -> None:
+        # Starlette doesn't call __aexit__ when __aenter__ raises, so clean
+        # up here before letting the error stop the server
+        try:
+            await self.start()
+        except BaseException:
+            await self.__aexit__(*sys.exc_info())
+            raise
     
-    logger.info("Shutting down Foundry Agent Accelerator...")
+    async def start(self) -> None:
+        app = self.app
+        
+        # ---------------------------------------------------------------------
+        # STEP 1: SET UP AZURE CREDENTIALS
+        # ---------------------------------------------------------------------
+        
+        logger.info("=" * 60)
+        logger.info("STARTING FOUNDRY AGENT ACCELERATOR")
+        logger.info("=" * 60)
+        
+        settings: Settings = app.state.settings
+        
+        # In local mode, start reading the config file state right away - the
+        # file I/O runs in the thread pool while the credential is being set up
+        config_state_task = None
+        if settings.config_source != "portal":
+            config_state_task = asyncio.gather(
+                run_in_threadpool(get_config_file_mtimes),
+                run_in_threadpool(get_stored_config_state),
+            )
+        self.config_state_task = config_state_task
+        
+        azure_credential = await run_in_threadpool(app.state.credential_factory)
+        self.credential = azure_credential
+        
+        # ---------------------------------------------------------------------
+        # STEP 2: CONNECT TO AZURE AI FOUNDRY PROJECT
+        # ---------------------------------------------------------------------
+        
+        endpoint = settings.project_endpoint
+        logger.info(f"Connecting to Azure AI Foundry project: {endpoint}")
+        
+        # Create the project client - this is our main connection to Foundry.
+        # All of its operations share one pooled, keep-alive HTTP session.
+        http_session = create_http_session()
+        self.http_session = http_session
+        project_client = AIProjectClient(
+            credential=azure_credential,
+            endpoint=endpoint,
+            transport=RequestsTransport(session=http_session, session_owner=False),
+        )
+        self.project_client = project_client
+        
+        # The OpenAI client is used to interact with the agent via the
+        # responses API, which supports streaming. It is async, so a long
+        # agent turn doesn't hold up other requests on this worker.
+        openai_client = await create_async_openai_client(azure_credential, endpoint)
+        self.openai_client = openai_client
+        
+        # Everything the routes need is collected in one place (see AppContext)
+        ctx = AppContext(
+            project_client=project_client,
+            openai_client=openai_client,
+            agent_name=settings.agent_name,
+        )
+        self.ctx = ctx
+        app.state.ctx = ctx
+        
+        # Optionally answer repeated questions from memory (per worker)
+        if settings.response_cache_size > 0:
+            ctx.response_cache = ResponseCache(settings.response_cache_size)
+            logger.info(f"💾 Response cache enabled ({settings.response_cache_size} responses)")
+        
+        # Optionally upload large attachments once instead of resending them
+        # with every turn; the cache maps attachment hashes to file ids
+        if settings.attachment_upload_min_size > 0:
+            ctx.uploaded_files = ResponseCache(UPLOADED_FILES_CACHE_SIZE)
+            ctx.attachment_upload_min_size = settings.attachment_upload_min_size
+            logger.info(f"📤 Uploading attachments of {settings.attachment_upload_min_size}+ bytes")
+        
+        # ---------------------------------------------------------------------
+        # STEP 3: CONNECT TO OR CREATE AGENT (BASED ON CONFIG SOURCE)
+        # ---------------------------------------------------------------------
+        # Two modes are supported:
+        # - LOCAL: Agent is configured via prompts/system.txt and agent.yaml
+        # - PORTAL: Agent is configured entirely in Azure AI Foundry portal
+        # ---------------------------------------------------------------------
+        
+        agent_name = settings.agent_name
+        model_name = settings.model_name
+        config_source = settings.config_source
+        
+        # Stays None when the agent is retrieved in the background (see fetch_agent)
+        agent = None
+        
+        logger.info("-" * 60)
+        
+        if config_source == "portal":
+            # -----------------------------------------------------------------
+            # PORTAL MODE: Agent is managed in Azure AI Foundry portal
+            # -----------------------------------------------------------------
+            logger.info("CONFIG MODE: PORTAL")
+            logger.info("-" * 60)
+            logger.info("Agent configuration is managed in Azure AI Foundry portal.")
+            logger.info("Local files (prompts/system.txt, agent.yaml) are IGNORED.")
+            logger.info("Changes made in the portal take effect immediately.")
+            logger.info("-" * 60)
+        
+            logger.info(f"Connecting to agent: {agent_name}")
+        
+            # In portal mode, tools are managed in the portal, not locally
+            enabled_tools = []
+        
+            try:
+                agent = await run_in_threadpool(project_client.agents.get, agent_name)
+                logger.info(f"✅ Connected to agent: {agent.name}")
+            except AzureError as e:
+                logger.error(f"❌ Could not find agent '{agent_name}' in Foundry!")
+                logger.error("   Create the agent in the Azure AI Foundry portal first,")
+                logger.error("   or switch to local mode by setting AGENT_CONFIG_SOURCE=local")
+                raise RuntimeError(f"Agent '{agent_name}' not found in Foundry: {e}") from e
+        
+        else:
+            # -----------------------------------------------------------------
+            # LOCAL MODE: Agent is managed via local config files
+            # -----------------------------------------------------------------
+            logger.info("CONFIG MODE: LOCAL")
+            logger.info("-" * 60)
+            logger.info("Agent configuration is managed via local files:")
+            logger.info("  • prompts/system.txt - Agent instructions")
+            logger.info("  • agent.yaml - Tool configuration")
+            logger.info("Portal changes will be OVERWRITTEN on restart.")
+            logger.info("-" * 60)
+        
+            # Note: Settings.from_env() has already checked that model_name is set
+        
+            # Check file modification times first - if nothing was touched since
+            # the last deployment, we don't need to read or hash anything
+            (sys_mtime, yaml_mtime), stored_state = await config_state_task
+        
+            unchanged_files = (
+                stored_state.get("sys_mtime") == sys_mtime
+                and stored_state.get("yaml_mtime") == yaml_mtime
+                and stored_state.get("endpoint") == endpoint
+                and stored_state.get("agent") == agent_name
+                and stored_state.get("model") == model_name
+            )
+        
+            if unchanged_files:
+                enabled_tools = stored_state.get("tools", [])
+        
+                logger.info("AGENT CONFIGURATION:")
+                logger.info(f"  Agent Name: {agent_name}")
+                logger.info(f"  Model: {model_name}")
+                logger.info(f"  Config Hash: {stored_state.get('hash', '')[:16]}...")
+                logger.info(f"  Tools: {', '.join(enabled_tools) if enabled_tools else 'None'}")
+                logger.info("-" * 40)
+        
+                # Config files untouched - reuse the agent stored with the state,
+                # or retrieve it if this state predates storing it
+                agent = StoredAgent.from_state(stored_state)
+                if agent is not None:
+                    logger.info("✅ Config unchanged (fast path) - using stored agent version")
+                else:
+                    logger.info("✅ Config unchanged (fast path) - using existing agent version")
+                    ctx.start_agent_fetch(stored_state)
+            else:
+                # Load configuration from local files and compute the hash of
+                # the current config (including tools) - these are independent
+                # blocking reads, so run them side by side in the thread pool
+                system_prompt, agent_config, current_hash = await asyncio.gather(
+                    run_in_threadpool(load_system_prompt),
+                    run_in_threadpool(load_agent_config),
+                    run_in_threadpool(compute_config_hash, agent_name, model_name, endpoint),
+                )
+                enabled_tools_config = get_enabled_tools(agent_config)
+                enabled_tools = list(enabled_tools_config)
+        
+                stored_hash = stored_state.get("hash")
+        
+                logger.info("AGENT CONFIGURATION:")
+                logger.info(f"  Agent Name: {agent_name}")
+                logger.info(f"  Model: {model_name}")
+                logger.info(f"  Instructions: {system_prompt[:80]}...")
+                logger.info(f"  Config Hash: {current_hash[:16]}...")
+        
+                # Log enabled tools
+                if enabled_tools:
+                    logger.info(f"  Tools: {', '.join(enabled_tools)}")
+                else:
+                    logger.info("  Tools: None")
+        
+                logger.info("-" * 40)
+        
+                # The hash and file mtimes are stored so the next unchanged
+                # restart can take the fast path
+                new_state = {
+                    "hash": current_hash,
+                    "sys_mtime": sys_mtime,
+                    "yaml_mtime": yaml_mtime,
+                    "endpoint": endpoint,
+                    "agent": agent_name,
+                    "model": model_name,
+                    "tools": enabled_tools,
+                }
+        
+                if current_hash == stored_hash:
+                    # Config unchanged - reuse the stored agent, or retrieve it
+                    agent = StoredAgent.from_state(stored_state)
+                    if agent is not None:
+                        logger.info("✅ Config unchanged - using stored agent version")
+                    else:
+                        logger.info("✅ Config unchanged - using existing agent version")
+                        ctx.start_agent_fetch(new_state)
+                else:
+                    # Config changed - create new version
+                    if stored_hash:
+                        logger.info("📝 Config changed - creating new agent version")
+                    else:
+                        logger.info("📝 First deployment - creating agent")
+        
+                    # Build tools from agent.yaml
+                    logger.info("Building tools...")
+                    tools = await build_tools(enabled_tools_config, project_client, settings)
+        
+                    # Create the agent with tools
+                    agent = await run_in_threadpool(
+                        project_client.agents.create_version,
+                        agent_name=agent_name,
+                        definition=PromptAgentDefinition(
+                            model=model_name,
+                            instructions=system_prompt,
+                            tools=tools if tools else None,
+                        ),
+                        description="Agent created/updated by Foundry Agent Accelerator",
+                    )
+        
+                    logger.info(f"✅ New version created!")
+                    logger.info(f"   ID: {agent.id}")
+                    logger.info(f"   Name: {agent.name}")
+                    logger.info(f"   Version: {agent.version}")
+        
+                # (a background fetch_agent() stores the state itself once done)
+                if agent is not None:
+                    new_state["agent_info"] = dataclasses.asdict(StoredAgent.from_agent(agent))
+                    store_config_state(new_state)
+        
+        # ---------------------------------------------------------------------
+        # STEP 4: MAKE THE AGENT AVAILABLE TO THE ROUTES
+        # ---------------------------------------------------------------------
+        
+        # Image generation needs the deployment name as an extra header
+        if "image_generation" in enabled_tools and settings.image_generation_deployment:
+            ctx.chat_extra_headers = {
+                "x-ms-oai-image-generation-deployment": settings.image_generation_deployment
+            }
+        
+        if agent is not None:
+            publish_agent(ctx, agent)
+        else:
+            logger.info("Accepting requests while the agent is retrieved in the background")
     
-    # Note: We do NOT delete the agent on shutdown
-    # The agent persists in Foundry and can be viewed in the portal
+    async def __aexit__(self, *exc_info: Any) -> None:
+        ctx = self.ctx
+        
+        # ---------------------------------------------------------------------
+        # SHUTDOWN: CLEAN UP RESOURCES
+        # ---------------------------------------------------------------------
+        
+        logger.info("Shutting down Foundry Agent Accelerator...")
+        
+        # Note: We do NOT delete the agent on shutdown
+        # The agent persists in Foundry and can be viewed in the portal
+        
+        # After a failed startup, anything below may not have been created
+        if ctx is not None and ctx.agent_task is not None and not ctx.agent_task.done():
+            ctx.agent_task.cancel()
+        
+        # Normally already awaited by start(); wait for (or stop) the config
+        # file reads so their result or error isn't left unretrieved
+        if self.config_state_task is not None:
+            self.config_state_task.cancel()
+            await asyncio.gather(self.config_state_task, return_exceptions=True)
+        
+        try:
+            if self.openai_client is not None:
+                # Shielded, so httpx still closes its connections when the
+                # shutdown itself is cancelled (e.g. by a second Ctrl+C)
+                await asyncio.shield(self.openai_client.close())
+        finally:
+            if self.project_client is not None:
+                self.project_client.close()
+            if self.http_session is not None:
+                self.http_session.close()
+            # Last, since the clients above may still use it while closing
+            if self.credential is not None:
+                self.credential.close()
+        
+        logger.info("Shutdown complete. Agent remains in Foundry!")
+
+
+# =============================================================================
+# ROUTE AUDIT
+# =============================================================================
+# FastAPI runs plain `def` endpoints and dependencies in a thread pool,
+# which adds a thread hop (and competes for a limited number of threads)
+# on every request. Everything in this app is cheap enough to be
+# `async def`, so we warn at startup if a sync handler sneaks in.
+# =============================================================================
+
+def _is_async_callable(call: Any) -> bool:
+    """Check if a function (or callable object like HTTPBasic) is async."""
+    # Async generators (e.g. the streaming /chat endpoint) run on the event
+    # loop too
+    for func in (call, getattr(call, "__call__", None)):
+        if inspect.iscoroutinefunction(func) or inspect.isasyncgenfunction(func):
+            return True
+    return False
+
+
+def find_sync_handlers(app: fastapi.FastAPI) -> list[str]:
+    """
+    Find endpoints and dependencies that are not `async def`.
     
-    project_client.close()
+    Args:
+        app: The FastAPI application
+        
+    Returns:
+        list: Human-readable descriptions of the sync handlers found
+    """
+    sync_handlers = []
+    # Newer FastAPI versions keep an included router as a single nested
+    # entry instead of copying its routes into app.routes, so walk into those
+    routes = list(app.routes)
+    while routes:
+        route = routes.pop(0)
+        included_router = getattr(route, "original_router", None)
+        if included_router is not None:
+            routes.extend(included_router.routes)
+            continue
+        if not isinstance(route, APIRoute):
+            continue
+        
+        if not _is_async_callable(route.endpoint):
+            sync_handlers.append(f"{route.path}: endpoint {route.endpoint.__name__}")
+        
+        # Walk the dependency tree (dependencies can have dependencies)
+        pending = list(route.dependant.dependencies)
+        while pending:
+            dependant = pending.pop()
+            if dependant.call is not None and not _is_async_callable(dependant.call):
+                name = getattr(dependant.call, "__name__", type(dependant.call).__name__)
+                sync_handlers.append(f"{route.path}: dependency {name}")
+            pending.extend(dependant.dependencies)
     
-    logger.info("Shutdown complete. Agent remains in Foundry!")
+    return sync_handlers
 
 
 # =============================================================================
 # APPLICATION FACTORY
 # =============================================================================
 
+# Path to the local development settings file (src/.env)
+ENV_FILE = Path(__file__).parent.parent / ".env"
+
+
 def create_app():
     """
     Create and configure the FastAPI application.
@@ -578,18 +1555,23 @@ def create_app():
     # LOAD ENVIRONMENT VARIABLES
     # -------------------------------------------------------------------------
     
-    if not os.getenv("RUNNING_IN_PRODUCTION"):
-        load_dotenv(override=True)
+    # Only look for src/.env in local development, and skip the dotenv
+    # directory search entirely when the file isn't there
+    if not os.getenv("RUNNING_IN_PRODUCTION") and ENV_FILE.is_file():
+        load_dotenv(ENV_FILE, override=True)
+    
+    # Read and validate all settings once (fails fast if something required
+    # is missing, before the server starts accepting requests)
+    settings = Settings.from_env()
     
     # -------------------------------------------------------------------------
     # SET UP LOGGING
     # -------------------------------------------------------------------------
     
-    global logger
-    logger = get_logger(
-        name="foundry-agent",
+    configure_logger(
+        logger,
         log_level=logging.INFO,
-        log_file_name=os.getenv("APP_LOG_FILE"),
+        log_file_name=settings.log_file,
         log_to_console=True
     )
     
@@ -600,7 +1582,7 @@ def create_app():
     # -------------------------------------------------------------------------
     
     app = fastapi.FastAPI(
-        lifespan=lifespan,
+        lifespan=Lifespan,
         title="Foundry Agent Accelerator",
         description="A starting point for building AI agents with Azure AI Foundry",
         version="2.0.0"  # Updated version for agent-based architecture
@@ -610,7 +1592,15 @@ def create_app():
     # MOUNT STATIC FILES
     # -------------------------------------------------------------------------
     
-    app.mount("/static", StaticFiles(directory="api/static"), name="static")
+    static_files = StaticFiles(directory=STATIC_DIR)
+    
+    # In production, serve assets from memory (the mount below still
+    # handles anything that wasn't preloaded). In development, files are
+    # always read from disk so rebuilt assets show up immediately.
+    if settings.running_in_production:
+        add_preloaded_static_route(app, static_files)
+    
+    app.mount("/static", static_files, name="static")
     
     # -------------------------------------------------------------------------
     # INCLUDE API ROUTES
@@ -619,6 +1609,17 @@ def create_app():
     from . import routes
     app.include_router(routes.router)
     
+    # Warn about handlers that would be pushed to the thread pool
+    sync_handlers = find_sync_handlers(app)
+    if sync_handlers:
+        logger.warning("Synchronous handlers found (these run in a thread pool):")
+        for handler in sync_handlers:
+            logger.warning(f"  • {handler}")
+    
+    # Pick the Azure credential type now that .env has been loaded
+    app.state.settings = settings
+    app.state.credential_factory = select_credential_factory(settings)
+    
     logger.info("Application created successfully")
     
     return app
@@ -41,22 +41,35 @@ DIFFERENCE FROM DIRECT CHAT COMPLETION:
 # =============================================================================
 
 # Python standard library
-import json      # For converting Python objects to JSON strings
+import base64    # For decoding large attachments before uploading them
+import binascii  # For the error raised on invalid base64
+import hashlib   # For hashing chat requests into response cache keys
 import logging   # For logging messages to console
 import os        # For reading environment variables and file paths
 import re        # For regex pattern matching
 import secrets   # For secure string comparison (authentication)
-from typing import Dict, Optional  # Type hints for better code readability
+from typing import AsyncIterator, Dict, Optional  # Type hints for better code readability
 
 # FastAPI - Web framework components
 import fastapi
 from fastapi import Request, Depends, HTTPException, status
-from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse
+from fastapi.sse import EventSourceResponse, ServerSentEvent
 from fastapi.templating import Jinja2Templates
+from fastapi.exceptions import RequestValidationError
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 
+# OpenAI - API errors from the files endpoint
+import openai
+
+# Pydantic - Request validation
+import pydantic
+
 # Local imports
-from .util import get_logger, ChatRequest  # Logger and request model
+from .util import ChatRequest, FileAttachment, Message  # Request models
+from .util import json_dumps, json_loads  # JSON helpers (use orjson when installed)
+from .code_format import format_code_interpreter_output  # Code fences (compiled with mypyc in Docker)
 
 
 # =============================================================================
@@ -70,8 +83,12 @@ username = os.getenv("WEB_APP_USERNAME")
 password = os.getenv("WEB_APP_PASSWORD")
 basic_auth_enabled = username and password
 
+# Encoded once for the constant-time comparisons in authenticate()
+username_bytes = username.encode("utf-8") if username else b""
+password_bytes = password.encode("utf-8") if password else b""
+
 
-def authenticate(credentials: Optional[HTTPBasicCredentials] = Depends(security)) -> None:
+async def authenticate(credentials: Optional[HTTPBasicCredentials] = Depends(security)) -> None:
     """
     Verify the user's credentials for basic HTTP authentication.
     """
@@ -85,8 +102,10 @@ def authenticate(credentials: Optional[HTTPBasicCredentials] = Depends(security)
             headers={"WWW-Authenticate": "Basic"},
         )
     
-    correct_username = secrets.compare_digest(credentials.username, username)
-    correct_password = secrets.compare_digest(credentials.password, password)
+    # Compare bytes: compare_digest rejects non-ASCII str arguments, and both
+    # comparisons always run so the response time doesn't reveal which failed
+    correct_username = secrets.compare_digest(credentials.username.encode("utf-8"), username_bytes)
+    correct_password = secrets.compare_digest(credentials.password.encode("utf-8"), password_bytes)
     
     if not (correct_username and correct_password):
         raise HTTPException(
@@ -103,12 +122,9 @@ auth_dependency = Depends(authenticate) if basic_auth_enabled else None
 # LOGGING SETUP
 # =============================================================================
 
-logger = get_logger(
-    name="foundry-agent-routes",
-    log_level=logging.INFO,
-    log_file_name=os.getenv("APP_LOG_FILE"),
-    log_to_console=True
-)
+# A child of the "foundry-agent" logger configured in main.create_app(), so
+# route messages go through the same handlers instead of opening their own
+logger = logging.getLogger("foundry-agent.routes")
 
 
 # =============================================================================
@@ -118,53 +134,167 @@ logger = get_logger(
 router = fastapi.APIRouter()
 templates = Jinja2Templates(directory="api/templates")
 
+# index.html has no per-request content, so in production it is rendered
+# once and the resulting bytes are reused. During local development it is
+# still rendered on every request so template edits show up immediately.
+cache_index_page = bool(os.getenv("RUNNING_IN_PRODUCTION"))
+index_page: Optional[bytes] = None
+
 
 # =============================================================================
 # HELPER FUNCTIONS - App State Accessors
 # =============================================================================
 
-def get_openai_client(request: Request):
+async def get_openai_client(request: Request):
     """
     Get the OpenAI client from app state.
     
-    The OpenAI client is created in main.py via project_client.get_openai_client()
+    The AsyncOpenAI client is created in main.py (create_async_openai_client)
     and is used to interact with the Foundry Agent.
     """
-    return request.app.state.openai_client
+    return request.app.state.ctx.openai_client
 
 
-def get_agent(request: Request):
+async def get_agent(request: Request):
     """
     Get the Foundry Agent from app state.
     
     The agent is created/updated in main.py during startup using
-    project_client.agents.create_version().
+    project_client.agents.create_version(). When the config is unchanged
+    the existing agent is retrieved in the background instead, so the
+    first requests may have to wait for that task to finish (or retry it,
+    see AppContext.resolve_agent in main.py).
     """
-    return request.app.state.agent
+    ctx = request.app.state.ctx
+    agent = ctx.agent
+    if agent is None:
+        agent = await ctx.resolve_agent()
+    return agent
 
 
-def get_image_generation_deployment(request: Request) -> str | None:
+def get_chat_extras(request: Request) -> tuple[dict | None, dict]:
     """
-    Get the image generation deployment name from app state.
+    Get the extra headers and body for responses.create() from app state.
     
-    This is needed to pass the x-ms-oai-image-generation-deployment header
-    when image generation tool is enabled.
+    The headers carry the x-ms-oai-image-generation-deployment header when
+    the image generation tool is enabled (None otherwise); the body holds
+    the agent_reference that routes the request to the Foundry Agent.
     """
-    return getattr(request.app.state, 'image_generation_deployment', None)
+    ctx = request.app.state.ctx
+    return ctx.chat_extra_headers, ctx.chat_extra_body
+
+
+# =============================================================================
+# REQUEST PARSING
+# =============================================================================
+
+# Largest /chat body read into memory (the conversation plus attachments)
+MAX_CHAT_REQUEST_SIZE = 64 * 1024 * 1024
+
+
+async def read_chat_body(request: Request) -> bytes:
+    """
+    Read the /chat request body, refusing bodies over MAX_CHAT_REQUEST_SIZE.
+    
+    A declared Content-Length that is too large is rejected before anything
+    is read; chunked bodies are counted as they arrive, so an oversized
+    upload never ends up in memory as a whole.
+    
+    Raises:
+        HTTPException: 413 if the body is too large
+    """
+    too_large = HTTPException(
+        status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+        detail=f"Request body larger than {MAX_CHAT_REQUEST_SIZE} bytes",
+    )
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdecimal() and int(content_length) > MAX_CHAT_REQUEST_SIZE:
+        raise too_large
+    
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > MAX_CHAT_REQUEST_SIZE:
+            raise too_large
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def parse_chat_request(request: Request) -> ChatRequest:
+    """
+    Parse and validate the /chat request body straight from the raw bytes.
+    
+    Chat bodies can be large (attachments are base64-encoded files).
+    model_validate_json() parses and validates them in a single pass inside
+    pydantic-core, instead of FastAPI first decoding the JSON into Python
+    objects and then validating those.
+    
+    Raises:
+        HTTPException: 413 if the body is too large (see read_chat_body)
+        RequestValidationError: If the body is not a valid ChatRequest
+            (answered with the usual 422 response)
+    """
+    try:
+        return ChatRequest.model_validate_json(await read_chat_body(request))
+    except pydantic.ValidationError as e:
+        raise RequestValidationError(
+            [{**error, "loc": ("body", *error["loc"])} for error in e.errors(include_url=False)]
+        ) from e
+
+
+# =============================================================================
+# PRECOMPILED PATTERNS
+# =============================================================================
+# The response helpers below run on every agent response, so their regular
+# expressions are compiled once here instead of being looked up in re's
+# internal cache on every call. The code fence patterns live with their
+# formatter in code_format.py.
+# =============================================================================
+
+# Citation markers: 【digits:digits†text】
+# Examples: 【4:6†source】, 【4:0†MMC_P7_Safety_Program_Overview.md】
+# Possessive quantifiers (Python 3.11+) never give characters back, so
+# malformed markers without a closing 】 fail fast instead of backtracking
+CITATION_PATTERN = re.compile(r'【(\d++):(\d++)†([^】]*+)】')
+DOUBLE_SPACE_PATTERN = re.compile(r'  +')
 
 
 # =============================================================================
 # SSE (Server-Sent Events) HELPER
 # =============================================================================
 
-def serialize_sse_event(data: Dict) -> str:
+def serialize_sse_event(data: Dict) -> ServerSentEvent:
     """
-    Convert a Python dictionary to SSE (Server-Sent Events) format.
+    Convert a Python dictionary to an SSE (Server-Sent Events) event.
     
     SSE is a standard for streaming data from server to browser.
-    Each message must be formatted as: "data: {json}\n\n"
+    Each message is sent as: "data: {json}\n\n"
+    
+    The JSON is serialized here (using orjson when installed) and passed
+    as raw data, so FastAPI frames it without encoding it a second time.
     """
-    return f"data: {json.dumps(data)}\n\n"
+    return ServerSentEvent(raw_data=json_dumps(data).decode("utf-8"))
+
+
+# Fixed events are built once at import instead of per request
+STREAM_END_EVENT = serialize_sse_event({"type": "stream_end"})
+# A completed_message without content: keep the streamed text as it is
+COMPLETED_UNCHANGED_EVENT = serialize_sse_event({"type": "completed_message"})
+CONTENT_FILTER_EVENT = serialize_sse_event({
+    "content": "Content was filtered for safety reasons.",
+    "type": "completed_message",
+})
+
+# Agent stream events handled in chat_stream_handler; everything else
+# (mostly response.output_text.delta) is skipped
+HANDLED_STREAM_EVENTS = frozenset({
+    'response.created',
+    'response.output_text.done',
+    'response.image_generation_call.partial_image',
+    'response.output_item.done',
+    'response.completed',
+})
 
 
 def clean_citation_markers(content: str) -> str:
@@ -182,160 +312,235 @@ def clean_citation_markers(content: str) -> str:
     Returns:
         str: Content with citation markers converted to footnotes
     """
-    # Pattern matches: 【digits:digits†text】
-    # Examples: 【4:6†source】, 【4:0†MMC_P7_Safety_Program_Overview.md】
-    citation_pattern = r'【(\d+):(\d+)†([^】]*)】'
-    
-    # Find all citations and track unique sources
-    citations = re.findall(citation_pattern, content)
-    
-    if not citations:
+    # Most responses carry no citations - skip the regex entirely for those
+    if '【' not in content:
         return content
     
-    # Build a map of unique sources to reference numbers
+    # Map unique sources to reference numbers as they are first seen, so
+    # finding and replacing the citations takes a single pass
     source_map = {}  # source_name -> reference_number
     source_list = []  # ordered list of unique sources
     
-    for doc_id, chunk_id, source_name in citations:
-        # Create a unique key for this source
-        source_key = source_name.strip()
-        if source_key and source_key not in source_map:
-            ref_num = len(source_list) + 1
-            source_map[source_key] = ref_num
-            source_list.append(source_key)
-    
     # Replace citations with superscript-style references
     def replace_citation(match):
-        doc_id, chunk_id, source_name = match.groups()
-        source_key = source_name.strip()
-        if source_key and source_key in source_map:
-            ref_num = source_map[source_key]
-            return f'<sup>[{ref_num}]</sup>'
-        return ''  # Remove if source is empty
+        source_key = match.group(3).strip()
+        if not source_key:
+            return ''  # Remove if source is empty
+        # One dict lookup whether the source is new or already numbered
+        ref_num = source_map.setdefault(source_key, len(source_list) + 1)
+        if ref_num > len(source_list):
+            source_list.append(source_key)
+        return f'<sup>[{ref_num}]</sup>'
     
-    cleaned = re.sub(citation_pattern, replace_citation, content)
+    cleaned, citation_count = CITATION_PATTERN.subn(replace_citation, content)
+    
+    if not citation_count:
+        return content
     
     # Clean up any double spaces left behind
-    cleaned = re.sub(r'  +', ' ', cleaned)
+    cleaned = DOUBLE_SPACE_PATTERN.sub(' ', cleaned)
+    
+    if not source_list:
+        return cleaned
+    
+    # Add sources section at the bottom, joined in one go so the (possibly
+    # long) response is copied only once
+    parts = [cleaned, "\n\n---\n\n**📚 Sources:**\n"]
+    for i, source in enumerate(source_list, 1):
+        # Clean up the source name for display
+        display_name = source.replace('_', ' ').replace('.md', '')
+        parts.append(f"\n[{i}] *{display_name}*")
+    return ''.join(parts)
+
+
+# Responses at least this long are post-processed in the threadpool
+POST_PROCESS_THREAD_MIN_SIZE = 64 * 1024
+
+
+def post_process_message(content: str) -> str:
+    """
+    Apply all display formatting to a complete agent response.
     
-    # Add sources section at the bottom if we have any
-    if source_list:
-        sources_section = "\n\n---\n\n**📚 Sources:**\n"
-        for i, source in enumerate(source_list, 1):
-            # Clean up the source name for display
-            display_name = source.replace('_', ' ').replace('.md', '')
-            sources_section += f"\n[{i}] *{display_name}*"
-        cleaned += sources_section
+    Args:
+        content: The full buffered response from the agent
+        
+    Returns:
+        str: Content with citations numbered and code output fenced
+    """
+    return format_code_interpreter_output(clean_citation_markers(content))
+
+
+# =============================================================================
+# MESSAGE CONVERSION
+# =============================================================================
+
+def image_key(item) -> str | int:
+    """
+    Identify a generated image, so it is sent to the client only once.
     
-    return cleaned
+    The same image_generation_call item arrives twice (when it is done and
+    again in the completed response); its id tells the two apart from other
+    images without comparing the base64 data. Items without an id fall back
+    to a hash of the image data.
+    """
+    return getattr(item, 'id', None) or hash(item.result)
+
+
+def attachment_payload(attachment: FileAttachment) -> str:
+    """Return an attachment's base64 data without any data URI prefix."""
+    data = attachment.data
+    if data.startswith("data:"):
+        return data.partition(",")[2]
+    return data
 
 
-def format_code_interpreter_output(content: str) -> str:
+async def upload_attachment(openai_client, uploaded_files, attachment: FileAttachment) -> str | None:
     """
-    Detect and wrap raw code interpreter output in markdown code fences.
+    Upload a large attachment through the files API, once per worker.
     
-    Code interpreter output typically starts with import statements and
-    contains Python code that should be formatted nicely in the UI.
+    The frontend sends the whole conversation - attachments included - with
+    every message. Uploading a large attachment once and referring to it by
+    file id means its base64 data isn't sent to the agent again on every
+    later turn.
     
     Args:
-        content: The raw response content from the agent
+        openai_client: The async OpenAI client
+        uploaded_files: Cache of file ids by attachment hash (ResponseCache)
+        attachment: The attachment to upload
         
     Returns:
-        str: Content with code interpreter blocks wrapped in ```python fences
-    """
-    lines = content.split('\n')
-    result_lines = []
-    code_block = []
-    in_code_block = False
-    
-    def is_code_line(line: str) -> bool:
-        """Check if a line looks like Python code."""
-        stripped = line.strip()
-        if not stripped:
-            return in_code_block  # Empty lines continue code blocks
+        str | None: The file id, or None if the upload failed (the
+        attachment is then sent inline as before)
+    """
+    payload = attachment_payload(attachment)
+    
+    # Hashing and decoding multi-MB payloads would stall the event loop.
+    # The name and type are part of the key, since they are uploaded too.
+    def digest() -> str:
+        hasher = hashlib.blake2b(f"{attachment.name}\0{attachment.type}\0".encode(), digest_size=16)
+        hasher.update(payload.encode("utf-8"))
+        return hasher.hexdigest()
+    
+    # validate=True rejects anything that isn't base64 instead of silently
+    # decoding it to an empty (or partial) file
+    def decode() -> bytes:
+        return base64.b64decode(payload, validate=True)
+    
+    try:
+        key = await run_in_threadpool(digest)
+        file_id = uploaded_files.get(key)
+        if file_id is not None:
+            return file_id
         
-        # NEVER treat markdown syntax as code
-        # Markdown headings (## Heading)
-        if re.match(r'^#{1,6}\s+\S', stripped):
-            return False
-        # Markdown images ![alt](url)
-        if re.match(r'^!\[.*?\]\(.*?\)$', stripped):
-            return False
-        # Base64 data URIs
-        if 'data:image/' in stripped:
-            return False
-        # Markdown bold/italic at start of line
-        if re.match(r'^\*{1,2}\w', stripped) or re.match(r'^_{1,2}\w', stripped):
-            return False
-        # Numbered lists with text (1. **Something**)
-        if re.match(r'^\d+\.\s+\*{0,2}\w', stripped):
-            return False
+        file_bytes = await run_in_threadpool(decode)
+        uploaded = await openai_client.files.create(
+            file=(attachment.name, file_bytes, attachment.type),
+            purpose="assistants",
+        )
+    except (binascii.Error, ValueError, openai.APIError) as e:
+        logger.warning(f"⚠️ Could not upload {attachment.name}, sending it inline: {e}", exc_info=True)
+        return None
+    
+    logger.info(f"📤 Uploaded attachment {attachment.name} as {uploaded.id}")
+    uploaded_files.put(key, uploaded.id)
+    return uploaded.id
+
+
+def build_content_items(message: Message, file_ids: dict[int, str] | None = None) -> list:
+    """
+    Convert a chat message into the content array of a responses API message.
+    
+    Args:
+        message: A message from the chat request (text and/or attachments)
+        file_ids: File ids of uploaded attachments, keyed by id(attachment)
+        
+    Returns:
+        list: input_text, input_image and input_file content items
+    """
+    # Add text content if present
+    content_items = [{"type": "input_text", "text": message.content}] if message.content else []
+    
+    # Most messages are text only - nothing more to add
+    if not message.attachments:
+        return content_items
+    
+    # Add file attachments (images, documents)
+    for attachment in message.attachments:
+        mime_type = attachment.type
+        # Images use input_image items, everything else input_file
+        is_image = mime_type.startswith("image/")
+        
+        # Uploaded attachments are referred to by file id
+        file_id = file_ids.get(id(attachment)) if file_ids else None
+        if file_id is not None:
+            if is_image:
+                content_items.append({"type": "input_image", "file_id": file_id, "detail": "auto"})
+            else:
+                content_items.append({"type": "input_file", "file_id": file_id})
+            continue
+        
+        # Hosted files are passed by URL - no base64 data to copy at all
+        if attachment.url:
+            if is_image:
+                content_items.append({"type": "input_image", "image_url": attachment.url, "detail": "auto"})
+            else:
+                content_items.append({"type": "input_file", "file_url": attachment.url})
+            continue
+        
+        base64_data = attachment.data
         
-        # Definite code patterns - must be actual Python code
-        code_patterns = [
-            stripped.startswith(('import ', 'from ')),
-            # Python comments start with # followed by space, but exclude markdown headings
-            stripped.startswith('# ') and not re.match(r'^#\s+[A-Z][a-z]+', stripped),
-            stripped.startswith(('def ', 'class ', 'if ', 'for ', 'while ', 'with ', 'try:', 'except')),
-            '=' in stripped and not stripped.endswith(':') and not stripped.startswith(('**', '*', '-', '•')),
-            stripped.startswith(('plt.', 'img.', 'df.', 'np.', 'pd.')),
-            '/mnt/data/' in stripped,
-            re.match(r'^[a-z_][a-z0-9_]*\.[a-z_]+\(', stripped),  # method calls like img.size()
-            re.match(r'^[a-z_][a-z0-9_]*\(', stripped),  # function calls like print()
-        ]
-        return any(code_patterns)
-    
-    def is_prose_line(line: str) -> bool:
-        """Check if a line looks like natural language prose."""
-        stripped = line.strip()
-        if not stripped:
-            return False
-        # Prose typically starts with capital letter and contains spaces/words
-        if re.match(r'^[A-Z][a-z]+.*\s+\w+', stripped):
-            # But exclude things that look like code
-            if not any(c in stripped for c in ['(', ')', '=', '.', '/']):
-                return True
-            # Check if it's a sentence (ends with punctuation or contains common words)
-            if re.search(r'(the |is |are |a |an |this |that |hazard|visible|image|worker)', stripped, re.IGNORECASE):
-                return True
-        # Bullet points are prose
-        if stripped.startswith(('- ', '* ', '• ')):
-            return True
-        return False
-    
-    for line in lines:
-        if is_prose_line(line) and in_code_block:
-            # End the code block
-            if code_block:
-                result_lines.append('```python')
-                result_lines.extend(code_block)
-                result_lines.append('```')
-                code_block = []
-            in_code_block = False
-            result_lines.append(line)
-        elif is_code_line(line):
-            in_code_block = True
-            code_block.append(line)
-        elif in_code_block and line.strip():
-            # Continue code block with non-empty lines that might be code
-            code_block.append(line)
+        # Attachments that already arrive as a data URI are passed
+        # through untouched; otherwise the URI is built with a single
+        # copy of the (possibly multi-MB) base64 payload
+        if base64_data.startswith("data:"):
+            data_uri = base64_data
         else:
-            if in_code_block and code_block:
-                # End code block on empty line if we have content
-                result_lines.append('```python')
-                result_lines.extend(code_block)
-                result_lines.append('```')
-                code_block = []
-                in_code_block = False
-            result_lines.append(line)
+            data_uri = f"data:{mime_type};base64,{base64_data}"
+        
+        if is_image:
+            # Image attachments use input_image type
+            content_items.append({
+                "type": "input_image",
+                "image_url": data_uri,
+                "detail": "auto"
+            })
+            logger.info(f"Added image attachment: {attachment.name} ({mime_type})")
+        else:
+            # For documents (PDF, text, etc.), include as text with file info
+            # Note: For more complex document handling, you might want to use
+            # file search or other tools in the agent
+            content_items.append({
+                "type": "input_file",
+                "file_data": data_uri,
+                "filename": attachment.name
+            })
+            logger.info(f"Added file attachment: {attachment.name} ({mime_type})")
     
-    # Handle any remaining code block
-    if code_block:
-        result_lines.append('```python')
-        result_lines.extend(code_block)
-        result_lines.append('```')
+    return content_items
+
+
+# =============================================================================
+# RESPONSE CACHE
+# =============================================================================
+
+def response_cache_key(chat_request: ChatRequest, agent_name: str, agent_version: str | None) -> str:
+    """
+    Build the response cache key for a (text-only) chat request.
     
-    return '\n'.join(result_lines)
+    The key covers the whole conversation and the agent version, so a new
+    agent version never answers from responses of the previous one.
+    
+    Args:
+        chat_request: The chat request (its messages have no attachments)
+        agent_name: The name of the agent answering the request
+        agent_version: The version of that agent
+        
+    Returns:
+        str: A hex digest identifying the request
+    """
+    conversation = [agent_name, agent_version]
+    conversation.extend((message.role, message.content) for message in chat_request.messages)
+    return hashlib.blake2b(json_dumps(conversation), digest_size=16).hexdigest()
 
 
 # =============================================================================
@@ -349,24 +554,24 @@ async def index(request: Request, _ = auth_dependency):
     
     URL: GET /
     """
-    return templates.TemplateResponse(
-        "index.html", 
-        {"request": request}
-    )
+    global index_page
+    if index_page is None or not cache_index_page:
+        index_page = templates.get_template("index.html").render(request=request).encode("utf-8")
+    return HTMLResponse(content=index_page)
 
 
 # =============================================================================
 # ENDPOINT: POST "/chat" - Handle Chat Messages via Foundry Agent
 # =============================================================================
 
-@router.post("/chat")
+@router.post("/chat", response_class=EventSourceResponse)
 async def chat_stream_handler(
     request: Request,
-    chat_request: ChatRequest,
+    chat_request: ChatRequest = Depends(parse_chat_request),
     openai_client = Depends(get_openai_client),
     agent = Depends(get_agent),
     _ = auth_dependency
-) -> fastapi.responses.StreamingResponse:
+) -> AsyncIterator[ServerSentEvent]:
     """
     Handle incoming chat messages and stream AI responses from the Foundry Agent.
     
@@ -375,349 +580,386 @@ async def chat_stream_handler(
     2. Sends them to the Foundry Agent via the OpenAI responses API
     3. Streams the response back using SSE (Server-Sent Events)
     
+    As an EventSourceResponse generator, FastAPI frames the yielded events,
+    sets the SSE headers (including X-Accel-Buffering for Nginx) and sends
+    a keep-alive comment whenever nothing was sent for 15 seconds - so
+    proxies don't drop the connection during long tool calls.
+    
     Args:
         chat_request: Contains the list of messages in the conversation
         openai_client: OpenAI client for agent interaction (injected)
         agent: The Foundry Agent instance (injected)
         
-    Returns:
-        StreamingResponse: SSE stream of the agent's response
+    Yields:
+        ServerSentEvent: SSE events of the agent's response
     """
     
     # -------------------------------------------------------------------------
-    # SET UP SSE RESPONSE HEADERS
+    # STEP 1: PREPARE MESSAGES FOR THE AGENT
+    # -------------------------------------------------------------------------
+    # Convert the incoming chat request into the format the agent expects.
+    # For the responses API, we use the "input" format with message objects.
     # -------------------------------------------------------------------------
     
-    headers = {
-        "Cache-Control": "no-cache",
-        "Connection": "keep-alive",
-        "Content-Type": "text/event-stream"
-    }
+    logger.info(f"Processing chat request with {len(chat_request.messages)} message(s)")
+    
+    # Repeated text-only conversations can be answered from the response
+    # cache (when enabled) without calling the agent at all
+    ctx = request.app.state.ctx
+    response_cache = ctx.response_cache
+    cache_key = None
+    if response_cache is not None and not any(message.attachments for message in chat_request.messages):
+        cache_key = response_cache_key(chat_request, agent.name, ctx.agent_version)
+        cached_event = response_cache.get(cache_key)
+        if cached_event is not None:
+            logger.info("💾 Answering from the response cache")
+            yield cached_event
+            yield STREAM_END_EVENT
+            return
+    
+    # Large attachments are uploaded once (when enabled) and then referred
+    # to by file id instead of being sent inline on every turn
+    file_ids = {}
+    uploaded_files = ctx.uploaded_files
+    if uploaded_files is not None:
+        for message in chat_request.messages:
+            for attachment in message.attachments:
+                if not attachment.url and len(attachment.data) >= ctx.attachment_upload_min_size:
+                    file_id = await upload_attachment(openai_client, uploaded_files, attachment)
+                    if file_id is not None:
+                        file_ids[id(attachment)] = file_id
+    
+    # Build the input messages for the agent
+    # The responses API expects a specific format
+    # Messages can include text and/or file attachments (images, documents)
+    input_messages = [
+        {
+            "type": "message",
+            "role": message.role,
+            "content": build_content_items(message, file_ids)
+        }
+        for message in chat_request.messages
+    ]
     
     # -------------------------------------------------------------------------
-    # RESPONSE STREAM GENERATOR
+    # STEP 2: SEND TO FOUNDRY AGENT AND STREAM RESPONSE
+    # -------------------------------------------------------------------------
+    # We use the OpenAI responses API with agent_reference to route
+    # the request to our Foundry Agent. This allows the agent's
+    # configuration (instructions, model, etc.) to be applied.
     # -------------------------------------------------------------------------
     
-    async def response_stream():
-        """
-        Generate streaming SSE response from the Foundry Agent.
-        """
+    try:
+        # Message parts are collected in a list and joined once at the end.
+        # Generated images are sent as their own events and never become
+        # part of the (post-processed) message text; the images already sent
+        # are remembered by output item id (see image_key)
+        message_parts = []
+        sent_images = set()
         
-        # ---------------------------------------------------------------------
-        # STEP 1: PREPARE MESSAGES FOR THE AGENT
-        # ---------------------------------------------------------------------
-        # Convert the incoming chat request into the format the agent expects.
-        # For the responses API, we use the "input" format with message objects.
-        # ---------------------------------------------------------------------
+        logger.info(f"Sending request to agent: {agent.name}")
         
-        logger.info(f"Processing chat request with {len(chat_request.messages)} message(s)")
-        
-        # Build the input messages for the agent
-        # The responses API expects a specific format
-        # Messages can include text and/or file attachments (images, documents)
-        input_messages = []
-        for message in chat_request.messages:
-            # Build the content array for this message
-            content_items = []
-            
-            # Add text content if present
-            if message.content:
-                content_items.append({
-                    "type": "input_text",
-                    "text": message.content
-                })
-            
-            # Add file attachments (images, documents)
-            for attachment in message.attachments:
-                mime_type = attachment.type
-                base64_data = attachment.data
-                
-                if mime_type.startswith("image/"):
-                    # Image attachments use input_image type
-                    content_items.append({
-                        "type": "input_image",
-                        "image_url": f"data:{mime_type};base64,{base64_data}",
-                        "detail": "auto"
-                    })
-                    logger.info(f"Added image attachment: {attachment.name} ({mime_type})")
-                else:
-                    # For documents (PDF, text, etc.), include as text with file info
-                    # Note: For more complex document handling, you might want to use
-                    # file search or other tools in the agent
-                    content_items.append({
-                        "type": "input_file",
-                        "file_data": f"data:{mime_type};base64,{base64_data}",
-                        "filename": attachment.name
-                    })
-                    logger.info(f"Added file attachment: {attachment.name} ({mime_type})")
-            
-            input_messages.append({
-                "type": "message",
-                "role": message.role,
-                "content": content_items
-            })
+        # The agent reference (extra_body) and, when image generation is
+        # enabled, the deployment header are built once at startup (see
+        # AppContext in main.py) and reused for every call below
+        extra_headers, extra_body = get_chat_extras(request)
         
         # ---------------------------------------------------------------------
-        # STEP 2: SEND TO FOUNDRY AGENT AND STREAM RESPONSE
+        # MCP AUTO-APPROVAL LOOP
         # ---------------------------------------------------------------------
-        # We use the OpenAI responses API with agent_reference to route
-        # the request to our Foundry Agent. This allows the agent's
-        # configuration (instructions, model, etc.) to be applied.
+        # Some agents use MCP tools that require approval. When an
+        # mcp_approval_request is received, we automatically approve it
+        # and continue the conversation. This loop handles multiple
+        # rounds of approval if needed.
         # ---------------------------------------------------------------------
         
-        try:
-            accumulated_message = ""
-            
-            logger.info(f"Sending request to agent: {agent.name}")
-            
-            # Check if image generation is enabled (requires special header)
-            image_gen_deployment = get_image_generation_deployment(request)
-            extra_headers = {}
-            if image_gen_deployment:
-                extra_headers["x-ms-oai-image-generation-deployment"] = image_gen_deployment
-            
-            # -----------------------------------------------------------------
-            # MCP AUTO-APPROVAL LOOP
-            # -----------------------------------------------------------------
-            # Some agents use MCP tools that require approval. When an
-            # mcp_approval_request is received, we automatically approve it
-            # and continue the conversation. This loop handles multiple
-            # rounds of approval if needed.
-            # -----------------------------------------------------------------
+        current_input = input_messages
+        max_approval_rounds = 10  # Prevent infinite loops
+        approval_round = 0
+        
+        while approval_round < max_approval_rounds:
+            approval_round += 1
+            pending_approvals = []
+            response_id = None
             
-            current_input = input_messages
-            max_approval_rounds = 10  # Prevent infinite loops
-            approval_round = 0
+            # Call the agent using the responses API with streaming
+            # The extra_body specifies which agent to use
+            response = await openai_client.responses.create(
+                input=current_input,
+                stream=True,
+                extra_headers=extra_headers,
+                extra_body=extra_body,
+            )
             
-            while approval_round < max_approval_rounds:
-                approval_round += 1
-                pending_approvals = []
-                response_id = None
+            # Process the streaming response
+            async for event in response:
+                # Stream events are typed models, so the fields of each
+                # handled event type are read directly
+                event_type = event.type
                 
-                # Call the agent using the responses API with streaming
-                # The extra_body specifies which agent to use
-                response = openai_client.responses.create(
-                    input=current_input,
-                    stream=True,
-                    extra_headers=extra_headers if extra_headers else None,
-                    extra_body={
-                        "agent": {
-                            "name": agent.name,
-                            "type": "agent_reference"
-                        }
-                    },
-                )
+                # Text deltas make up most of the stream and aren't used -
+                # skip them (and any other unhandled event) with one lookup
+                if event_type not in HANDLED_STREAM_EVENTS:
+                    if event_type != 'response.output_text.delta':
+                        # Log unhandled event types for debugging MCP issues
+                        logger.debug("Event received: %s", event_type)
+                    continue
                 
-                # Process the streaming response
-                for event in response:
-                    event_type = getattr(event, 'type', None)
-                    
-                    # Log all event types for debugging MCP issues
-                    if event_type and event_type not in ['response.output_text.delta']:
-                        logger.debug(f"Event received: {event_type}")
-                    
-                    # Capture response ID for follow-up requests
-                    if event_type == 'response.created':
-                        if hasattr(event, 'response') and hasattr(event.response, 'id'):
-                            response_id = event.response.id
-                    
-                    # Handle text output done event
-                    elif event_type == 'response.output_text.done':
-                        if hasattr(event, 'text') and event.text:
-                            text_content = event.text
-                            
-                            # Check if this looks like MCP tool JSON data
-                            # (internal agent data that shouldn't be shown raw)
-                            stripped_text = text_content.strip()
-                            if stripped_text.startswith('{') and stripped_text.endswith('}'):
-                                try:
-                                    # Try to parse as JSON - if successful, format it nicely
-                                    parsed_json = json.loads(stripped_text)
-                                    
-                                    # Check if it's an MCP/tool request (has specific keys)
-                                    if 'request' in parsed_json or 'knowledgeAgentIntents' in parsed_json:
-                                        # Format as a visible tool call indicator with code block
-                                        formatted_json = json.dumps(parsed_json, indent=2)
-                                        text_content = f'\n\n> 🔍 **Querying knowledge base...**\n\n```json\n{formatted_json}\n```\n\n---\n\n'
-                                        logger.info(f"Formatted MCP tool JSON for display")
-                                except json.JSONDecodeError:
-                                    # Not valid JSON, show as-is
-                                    pass
-                            
-                            # Buffer content - don't stream to avoid duplication issues
-                            accumulated_message += text_content
-                            logger.info(f"Text output (buffered): {event.text[:100]}...")
-                    
-                    # Handle partial image event (streaming partial images)
-                    elif event_type == 'response.image_generation_call.partial_image':
-                        if hasattr(event, 'partial_image_b64') and event.partial_image_b64:
-                            # Buffer partial image (will show final in completed_message)
-                            logger.info("Partial image received (buffering)")
-                    
-                    # Handle output item done event (contains completed items including MCP approvals)
-                    elif event_type == 'response.output_item.done':
-                        if hasattr(event, 'item') and event.item:
-                            item = event.item
-                            item_type = getattr(item, 'type', None)
-                            logger.info(f"Output item done - type: {item_type}")
-                            
-                            # Handle MCP approval requests - collect for auto-approval
-                            if item_type == 'mcp_approval_request':
-                                approval_id = getattr(item, 'id', None)
-                                tool_name = getattr(item, 'name', 'unknown')
-                                server_label = getattr(item, 'server_label', 'unknown')
-                                arguments = getattr(item, 'arguments', '{}')
+                # Per-event logs are DEBUG and %-style, so nothing is formatted
+                # unless debug logging is actually on
+                logger.debug("Event received: %s", event_type)
+                
+                # Capture response ID for follow-up requests
+                if event_type == 'response.created':
+                    response_id = event.response.id
+                
+                # Handle text output done event
+                elif event_type == 'response.output_text.done':
+                    text_content = event.text
+                    if text_content:
+                        
+                        # Check if this looks like MCP tool JSON data
+                        # (internal agent data that shouldn't be shown raw)
+                        # Only parse text that can hold one of the MCP keys checked
+                        # below - ordinary answers never reach the JSON parser
+                        stripped_text = text_content.strip()
+                        if (
+                            stripped_text.startswith('{')
+                            and stripped_text.endswith('}')
+                            and ('"request"' in stripped_text or '"knowledgeAgentIntents"' in stripped_text)
+                        ):
+                            try:
+                                # Try to parse as JSON - if successful, format it nicely
+                                parsed_json = json_loads(stripped_text)
                                 
-                                if approval_id:
-                                    # Store the full item for inclusion in the next request
-                                    pending_approvals.append({
+                                # Check if it's an MCP/tool request (has specific keys)
+                                if 'request' in parsed_json or 'knowledgeAgentIntents' in parsed_json:
+                                    # Format as a visible tool call indicator with code block
+                                    formatted_json = json_dumps(parsed_json, indent=True).decode('utf-8')
+                                    text_content = f'\n\n> 🔍 **Querying knowledge base...**\n\n```json\n{formatted_json}\n```\n\n---\n\n'
+                                    logger.info(f"Formatted MCP tool JSON for display")
+                            except ValueError:
+                                # Not valid JSON (json and orjson decode errors are
+                                # both ValueErrors), show as-is
+                                pass
+                        
+                        # Stream the text right away so the user sees the answer
+                        # as it is produced; the completed_message sent at the end
+                        # replaces the streamed text with the formatted result
+                        message_parts.append(text_content)
+                        yield serialize_sse_event({
+                            "content": text_content,
+                            "type": "message",
+                        })
+                        if logger.isEnabledFor(logging.DEBUG):
+                            logger.debug("Text output (streamed): %s...", event.text[:100])
+                
+                # Handle partial image event (streaming partial images)
+                elif event_type == 'response.image_generation_call.partial_image':
+                    if event.partial_image_b64:
+                        # Skip partial images (the final image is sent as an image event)
+                        logger.debug("Partial image received (skipped)")
+                
+                # Handle output item done event (contains completed items including MCP approvals)
+                elif event_type == 'response.output_item.done':
+                    item = event.item
+                    if item:
+                        item_type = getattr(item, 'type', None)
+                        logger.debug("Output item done - type: %s", item_type)
+                        
+                        # Handle MCP approval requests - collect for auto-approval
+                        if item_type == 'mcp_approval_request':
+                            approval_id = getattr(item, 'id', None)
+                            tool_name = getattr(item, 'name', 'unknown')
+                            server_label = getattr(item, 'server_label', 'unknown')
+                            arguments = getattr(item, 'arguments', '{}')
+                            
+                            if approval_id:
+                                # Store the full item for inclusion in the next request
+                                pending_approvals.append({
+                                    'id': approval_id,
+                                    'name': tool_name,
+                                    'server_label': server_label,
+                                    'arguments': arguments,
+                                    'original_item': {
+                                        'type': 'mcp_approval_request',
                                         'id': approval_id,
                                         'name': tool_name,
                                         'server_label': server_label,
-                                        'arguments': arguments,
-                                        'original_item': {
-                                            'type': 'mcp_approval_request',
-                                            'id': approval_id,
-                                            'name': tool_name,
-                                            'server_label': server_label,
-                                            'arguments': arguments
-                                        }
-                                    })
-                                    logger.info(f"MCP approval request collected: {tool_name} (server: {server_label})")
-                                    
-                                    # Buffer tool notification (will be included in final message)
-                                    accumulated_message += f"\n\n🔧 *Using tool: {tool_name}...*\n\n"
-                            
-                            elif item_type == 'mcp_list_tools':
-                                # MCP server is listing available tools - just log it
-                                logger.info("MCP tools list received")
-                            
-                            elif item_type == 'mcp_call':
-                                # MCP tool call completed - log the result for debugging
-                                tool_name = getattr(item, 'name', 'unknown')
-                                error = getattr(item, 'error', None)
+                                        'arguments': arguments
+                                    }
+                                })
+                                logger.info(f"MCP approval request collected: {tool_name} (server: {server_label})")
                                 
-                                # Log the full MCP call details for debugging
-                                arguments = getattr(item, 'arguments', None)
-                                server_label = getattr(item, 'server_label', 'unknown')
-                                logger.info(f"MCP call details - tool: {tool_name}, server: {server_label}, args: {arguments}")
-                                
-                                if error:
-                                    logger.error(f"MCP tool '{tool_name}' failed: {error}")
-                                    accumulated_message += f"\n\n⚠️ *Tool error: {tool_name} - {error}*\n\n"
-                                else:
-                                    # MCP calls typically don't expose result directly in the item
-                                    # The result is processed by the agent and appears in the text output
-                                    logger.info(f"MCP tool '{tool_name}' call completed")
+                                # Stream tool notification (also included in final message)
+                                tool_notice = f"\n\n🔧 *Using tool: {tool_name}...*\n\n"
+                                message_parts.append(tool_notice)
+                                yield serialize_sse_event({
+                                    "content": tool_notice,
+                                    "type": "message",
+                                })
+                        
+                        elif item_type == 'mcp_list_tools':
+                            # MCP server is listing available tools - just log it
+                            logger.info("MCP tools list received")
+                        
+                        elif item_type == 'mcp_call':
+                            # MCP tool call completed - log the result for debugging
+                            tool_name = getattr(item, 'name', 'unknown')
+                            error = getattr(item, 'error', None)
+                            
+                            # Log the full MCP call details for debugging
+                            arguments = getattr(item, 'arguments', None)
+                            server_label = getattr(item, 'server_label', 'unknown')
+                            logger.info(f"MCP call details - tool: {tool_name}, server: {server_label}, args: {arguments}")
                             
-                            elif item_type == 'image_generation_call':
-                                # Get the result (base64 image data)
-                                if hasattr(item, 'result') and item.result:
-                                    image_base64 = item.result
-                                    # Buffer image HTML (will be sent in completed_message)
-                                    image_html = f'\n\n<img src="data:image/png;base64,{image_base64}" alt="Generated Image" style="max-width: 100%; border-radius: 8px; margin: 16px 0;" />\n\n'
-                                    accumulated_message += image_html
-                                    logger.info("Image generation completed (buffered)")
-                    
-                    # Handle response completed event (final response with all outputs)
-                    elif event_type == 'response.completed':
-                        if hasattr(event, 'response') and event.response:
-                            resp = event.response
-                            if hasattr(resp, 'output') and resp.output:
-                                for output_item in resp.output:
-                                    item_type = getattr(output_item, 'type', None)
-                                    if item_type == 'image_generation_call' and hasattr(output_item, 'result') and output_item.result:
-                                        # Only add if not already buffered
-                                        if 'Generated Image' not in accumulated_message:
-                                            image_base64 = output_item.result
-                                            image_html = f'\n\n<img src="data:image/png;base64,{image_base64}" alt="Generated Image" style="max-width: 100%; border-radius: 8px; margin: 16px 0;" />\n\n'
-                                            accumulated_message += image_html
-                                            logger.info("Image from completed response (buffered)")
-                                    # Note: We don't process 'message' type here anymore
-                                    # because it was already buffered via response.output_text.done
-                    
-                    # Note: Legacy fallback handlers (output_text, delta) are disabled
-                    # when using MCP agents to prevent duplicate output. The content
-                    # is buffered and sent once via completed_message.
+                            if error:
+                                logger.error(f"MCP tool '{tool_name}' failed: {error}")
+                                tool_notice = f"\n\n⚠️ *Tool error: {tool_name} - {error}*\n\n"
+                                message_parts.append(tool_notice)
+                                yield serialize_sse_event({
+                                    "content": tool_notice,
+                                    "type": "message",
+                                })
+                            else:
+                                # MCP calls typically don't expose result directly in the item
+                                # The result is processed by the agent and appears in the text output
+                                logger.info(f"MCP tool '{tool_name}' call completed")
+                        
+                        elif item_type == 'image_generation_call':
+                            # Get the result (base64 image data)
+                            if getattr(item, 'result', None):
+                                # Send the image right away as its own event; the
+                                # frontend renders it next to the message text
+                                yield serialize_sse_event({
+                                    "data": item.result,
+                                    "mime": "image/png",
+                                    "type": "image",
+                                })
+                                sent_images.add(image_key(item))
+                                logger.info("Image generation completed (sent)")
                 
-                # -----------------------------------------------------------------
-                # CHECK FOR PENDING MCP APPROVALS
-                # -----------------------------------------------------------------
-                # If we collected any approval requests, send approvals and continue
-                # -----------------------------------------------------------------
+                # Handle response completed event (final response with all outputs)
+                elif event_type == 'response.completed':
+                    resp = event.response
+                    if resp:
+                        if resp.output:
+                            for output_item in resp.output:
+                                item_type = getattr(output_item, 'type', None)
+                                if item_type == 'image_generation_call' and getattr(output_item, 'result', None):
+                                    # Only send images that weren't sent already
+                                    key = image_key(output_item)
+                                    if key not in sent_images:
+                                        yield serialize_sse_event({
+                                            "data": output_item.result,
+                                            "mime": "image/png",
+                                            "type": "image",
+                                        })
+                                        sent_images.add(key)
+                                        logger.info("Image from completed response (sent)")
+                                # Note: We don't process 'message' type here anymore
+                                # because it was already buffered via response.output_text.done
                 
-                if pending_approvals:
-                    logger.info(f"Auto-approving {len(pending_approvals)} MCP tool request(s)")
-                    
-                    # Build input with both original approval requests and responses
-                    # The API requires the original requests to be passed alongside responses
-                    approval_input = []
-                    
-                    # First, add all the original approval request items
-                    for approval in pending_approvals:
-                        approval_input.append(approval['original_item'])
-                    
-                    # Then, add all the approval responses
-                    for approval in pending_approvals:
-                        approval_input.append({
-                            "type": "mcp_approval_response",
-                            "approval_request_id": approval['id'],
-                            "approve": True
-                        })
-                    
-                    # Set up the next request with both requests and responses
-                    current_input = approval_input
-                    logger.info(f"Sending approval responses, round {approval_round}")
-                    
-                    # Continue the loop to process the response after approval
-                    continue
-                else:
-                    # No pending approvals, we're done
-                    break
-            
-            if approval_round >= max_approval_rounds:
-                logger.warning(f"Reached maximum approval rounds ({max_approval_rounds})")
-            
-            # Send the complete buffered message
-            logger.info(f"Response complete: {len(accumulated_message)} characters")
+                # Note: Legacy fallback handlers (output_text, delta) are disabled
+                # when using MCP agents to prevent duplicate output. Text is
+                # streamed per completed output and the final formatted message
+                # is sent once via completed_message.
             
-            # Clean up citation markers and format code interpreter output
-            cleaned_message = clean_citation_markers(accumulated_message)
-            formatted_message = format_code_interpreter_output(cleaned_message)
-            
-            yield serialize_sse_event({
-                "content": formatted_message,
-                "type": "completed_message",
-            })
-            
-        except Exception as e:
             # -----------------------------------------------------------------
-            # ERROR HANDLING
+            # CHECK FOR PENDING MCP APPROVALS
+            # -----------------------------------------------------------------
+            # If we collected any approval requests, send approvals and continue
             # -----------------------------------------------------------------
             
-            error_text = str(e)
-            logger.error(f"Agent chat error: {error_text}")
-            
-            # Check for content filter errors
-            if 'content_filter' in error_text.lower():
-                response = "Content was filtered for safety reasons."
+            if pending_approvals:
+                logger.info(f"Auto-approving {len(pending_approvals)} MCP tool request(s)")
+                
+                # Build input with both original approval requests and responses
+                # The API requires the original requests to be passed alongside responses
+                approval_input = []
+                
+                # First, add all the original approval request items
+                for approval in pending_approvals:
+                    approval_input.append(approval['original_item'])
+                
+                # Then, add all the approval responses
+                for approval in pending_approvals:
+                    approval_input.append({
+                        "type": "mcp_approval_response",
+                        "approval_request_id": approval['id'],
+                        "approve": True
+                    })
+                
+                # Set up the next request with both requests and responses
+                current_input = approval_input
+                logger.info(f"Sending approval responses, round {approval_round}")
+                
+                # Continue the loop to process the response after approval
+                continue
             else:
-                response = f"An error occurred: {error_text}"
-            
-            yield serialize_sse_event({
-                "content": response,
+                # No pending approvals, we're done
+                break
+        
+        if approval_round >= max_approval_rounds:
+            logger.warning(f"Reached maximum approval rounds ({max_approval_rounds})")
+        
+        # Send the complete buffered message
+        accumulated_message = "".join(message_parts)
+        logger.info(f"Response complete: {len(accumulated_message)} characters")
+        
+        # Clean up citation markers and format code interpreter output.
+        # This is pure CPU work over the whole response, so large responses
+        # (e.g. long code interpreter output) are handled in the threadpool
+        # where they don't hold up other requests on the event loop
+        if len(accumulated_message) >= POST_PROCESS_THREAD_MIN_SIZE:
+            formatted_message = await run_in_threadpool(post_process_message, accumulated_message)
+        else:
+            formatted_message = post_process_message(accumulated_message)
+        
+        completed_event = None
+        if formatted_message == accumulated_message:
+            # Nothing was reformatted - the client already holds exactly this
+            # text from the streamed chunks, so don't send it a second time
+            yield COMPLETED_UNCHANGED_EVENT
+        else:
+            completed_event = serialize_sse_event({
+                "content": formatted_message,
                 "type": "completed_message",
             })
+            yield completed_event
         
+        # Cache the finished answer. Responses with generated images are
+        # left out - they are large, and users expect a new image each time
+        if cache_key is not None and not sent_images:
+            if completed_event is None:
+                completed_event = serialize_sse_event({
+                    "content": formatted_message,
+                    "type": "completed_message",
+                })
+            response_cache.put(cache_key, completed_event)
+        
+    except Exception as e:
         # ---------------------------------------------------------------------
-        # STEP 3: END THE STREAM
+        # ERROR HANDLING
         # ---------------------------------------------------------------------
         
-        yield serialize_sse_event({
-            "type": "stream_end"
-        })
+        error_text = str(e)
+        logger.error(f"Agent chat error: {error_text}")
+        
+        # Check for content filter errors
+        if 'content_filter' in error_text.lower():
+            yield CONTENT_FILTER_EVENT
+        else:
+            yield serialize_sse_event({
+                "content": f"An error occurred: {error_text}",
+                "type": "completed_message",
+            })
+    
+    # -------------------------------------------------------------------------
+    # STEP 3: END THE STREAM
+    # -------------------------------------------------------------------------
     
-    return StreamingResponse(response_stream(), headers=headers)
+    yield STREAM_END_EVENT
 
 
 # =============================================================================
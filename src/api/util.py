@@ -1,12 +1,25 @@
 # Copyright (c) Microsoft. All rights reserved.
 # Licensed under the MIT license.
 # See LICENSE file in the project root for full license information.
-from typing import Optional
+from typing import Any, Optional
 
+import atexit
+import collections
+import json
 import logging
+import logging.handlers
+import os
 import pydantic
+import queue
 import sys
 
+# orjson is a fast JSON library implemented in Rust. It is optional: if it
+# isn't installed, the helpers below fall back to the standard json module.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 def get_logger(name: str,
                log_level: int = logging.INFO,
@@ -21,26 +34,166 @@ def get_logger(name: str,
     :param log_to_console: Boolean showing if we want to log into the console.
     :returns: The logger object.
     """
-    logger = logging.getLogger(name)
+    return configure_logger(logging.getLogger(name),
+                            log_level=log_level,
+                            log_file_name=log_file_name,
+                            log_to_console=log_to_console)
+
+
+def configure_logger(logger: logging.Logger,
+                     log_level: int = logging.INFO,
+                     log_file_name: Optional[str] = None,
+                     log_to_console: bool=True) -> logging.Logger:
+    """
+    Attach console and/or file handlers to an existing logger.
+
+    This lets modules create their logger once at import time with
+    logging.getLogger() and have it configured later (e.g. in create_app).
+    Child loggers (e.g. "foundry-agent.routes") need no handlers of their
+    own - their records propagate to the configured parent.
+
+    :param logger: The logger to configure.
+    :param log_level: The logging verbosity level.
+    :param log_file_name: The file to be sed to write logs if any.
+    :param log_to_console: Boolean showing if we want to log into the console.
+    :returns: The same logger object.
+    """
     logger.setLevel(log_level)
     
+    # create_app() can run more than once per process (module import and the
+    # gunicorn app factory). Only attach handlers the first time, otherwise
+    # every line would be formatted and written once per call.
+    if logger.handlers:
+        return logger
+    
+    handlers = []
+    
     if log_to_console:
         # Configure the stream handler (stdout)
         stream_handler = logging.StreamHandler(sys.stdout)
-        stream_handler.setLevel(logging.INFO)
+        stream_handler.setLevel(log_level)
         stream_formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(name)s: %(message)s")
         stream_handler.setFormatter(stream_formatter)
-        logger.addHandler(stream_handler)
+        handlers.append(stream_handler)
     
     if log_file_name:
         file_handler = logging.FileHandler(log_file_name)
         file_handler.setLevel(log_level)
         file_formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(name)s: %(message)s")
         file_handler.setFormatter(file_formatter)
-        logger.addHandler(file_handler)
+        handlers.append(file_handler)
+    
+    if handlers:
+        logger.addHandler(start_log_listener(handlers))
+        # The records are written by our own handlers; don't also hand them
+        # to any handlers on the root logger (which would print them twice)
+        logger.propagate = False
     return logger
 
 
+def start_log_listener(handlers: list[logging.Handler]) -> logging.handlers.QueueHandler:
+    """
+    Run handlers on a background thread, fed through a queue.
+
+    Code that logs (e.g. a request handler on the event loop) only pays for
+    putting the record on the queue; formatting and the console/file writes
+    happen on the listener thread.
+
+    :param handlers: The handlers that actually write the log records.
+    :returns: A QueueHandler to attach to the logger.
+    """
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+
+    def restart_in_child() -> None:
+        # Threads don't survive fork() - gunicorn loads the app and then forks
+        # the workers - so every worker starts a listener of its own
+        nonlocal listener
+        child_queue = queue.SimpleQueue()
+        queue_handler.queue = child_queue
+        listener = logging.handlers.QueueListener(child_queue, *handlers, respect_handler_level=True)
+        listener.start()
+
+    os.register_at_fork(after_in_child=restart_in_child)
+    # Flush whatever is still queued when the process exits
+    atexit.register(lambda: listener.stop())
+    return queue_handler
+
+
+def json_dumps(data: Any, indent: bool = False) -> bytes:
+    """
+    Serialize data to UTF-8 encoded JSON bytes.
+
+    :param data: The object to serialize.
+    :param indent: Pretty-print with two-space indentation (for display).
+    :returns: The JSON document as bytes.
+    """
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 if indent else None)
+    if indent:
+        return json.dumps(data, indent=2, ensure_ascii=False).encode("utf-8")
+    # Compact separators, matching orjson's output
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def json_loads(data: bytes | str) -> Any:
+    """
+    Parse a JSON document.
+
+    :param data: The JSON document as bytes or str.
+    :returns: The parsed object.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class ResponseCache:
+    """
+    A bounded LRU cache of finished chat responses (or uploaded file ids).
+
+    It is only used from the event loop and never awaits while reading or
+    updating its entries, so it needs no lock.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        """
+        :param maxsize: The number of responses to keep.
+        """
+        self._maxsize = maxsize
+        self._entries: collections.OrderedDict[str, Any] = collections.OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Look up a response and mark it as most recently used.
+
+        :param key: The cache key of the request.
+        :returns: The cached response, or None.
+        """
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        """
+        Store a response, evicting the least recently used one when full.
+
+        :param key: The cache key of the request.
+        :param value: The response to cache.
+        """
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+
+# Largest base64 payload accepted for one attachment (about 24 MB of file)
+MAX_ATTACHMENT_DATA_LENGTH = 32 * 1024 * 1024
+
+
 class FileAttachment(pydantic.BaseModel):
     """
     Represents a file attached to a chat message.
@@ -48,11 +201,25 @@ class FileAttachment(pydantic.BaseModel):
     Attributes:
         name: Original filename
         type: MIME type (e.g., 'image/jpeg', 'application/pdf')
-        data: Base64-encoded file content
+        data: Base64-encoded file content (empty when url is given)
+        url: Where the file is already hosted (e.g. blob storage), if anywhere
     """
     name: str
     type: str
-    data: str  # Base64-encoded content
+    data: str = pydantic.Field("", max_length=MAX_ATTACHMENT_DATA_LENGTH)  # Base64-encoded content
+    url: str | None = None  # Passed to the agent as is, instead of data
+
+    @pydantic.model_validator(mode="after")
+    def check_data_or_url(self) -> "FileAttachment":
+        """
+        Require exactly one of data and url.
+
+        :returns: The validated attachment.
+        :raises ValueError: If both or neither are given.
+        """
+        if bool(self.data) == bool(self.url):
+            raise ValueError("an attachment needs either data or url (not both)")
+        return self
 
 
 class Message(pydantic.BaseModel):
@@ -27,6 +27,8 @@
  * Message Types from Server:
  * - { type: "message", content: "..." } - A chunk of the response
  * - { type: "completed_message", content: "..." } - The full response
+ *   (without content when the streamed chunks already are the full response)
+ * - { type: "image", data: "...", mime: "..." } - A generated image (base64)
  * - { type: "stream_end" } - Stream finished, stop processing
  * 
  * =============================================================================
@@ -238,6 +240,9 @@ export function AgentPreview({ agentDetails }: IAgentPreviewProps): ReactNode {
   ) => {
     let chatItem: IChatItem | null = null;
     let accumulatedContent = "";
+    // Generated images arrive as separate events and are shown above the
+    // text, so they survive the completed_message replacing the text
+    let imageContent = "";
     let isStreaming = true;
     let buffer = "";
 
@@ -317,7 +322,9 @@ export function AgentPreview({ agentDetails }: IAgentPreviewProps): ReactNode {
 
               if (data.type === "completed_message") {
                 clearAssistantMessage(chatItem);
-                accumulatedContent = data.content;
+                if (data.content !== undefined) {
+                  accumulatedContent = data.content;
+                }
                 isStreaming = false;
                 console.log(
                   "[ChatClient] Received completed message:",
@@ -325,6 +332,9 @@ export function AgentPreview({ agentDetails }: IAgentPreviewProps): ReactNode {
                 );
 
                 setIsResponding(false);
+              } else if (data.type === "image") {
+                imageContent += `<img src="data:${data.mime};base64,${data.data}" alt="Generated Image" style="max-width: 100%; border-radius: 8px; margin: 16px 0;" />\n\n`;
+                console.log("[ChatClient] Received generated image.");
               } else {
                 accumulatedContent += data.content;
                 console.log(
@@ -334,7 +344,7 @@ export function AgentPreview({ agentDetails }: IAgentPreviewProps): ReactNode {
               }
 
             //   // Update the UI with the accumulated content
-              appendAssistantMessage(chatItem, accumulatedContent, isStreaming);
+              appendAssistantMessage(chatItem, imageContent + accumulatedContent, isStreaming);
             }
           }
 
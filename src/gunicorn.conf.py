@@ -18,9 +18,21 @@ if not os.getenv("RUNNING_IN_PRODUCTION"):
 # https://docs.gunicorn.org/en/stable/settings.html
 preload_app = True
 num_cpus = multiprocessing.cpu_count()
-workers = (num_cpus * 2) + 1
+# (2 * CPUs) + 1 is the formula for sync workers. Each UvicornWorker serves
+# many chat streams at once on its event loop (they mostly wait on the
+# agent), so one worker per CPU is enough; every extra worker only costs
+# memory for its own copy of the SDK clients and caches.
+workers = max(2, num_cpus)
 worker_class = "uvicorn.workers.UvicornWorker"
 
+# UvicornWorker runs on uvloop with the httptools parser (both installed by
+# uvicorn[standard] and picked automatically), and takes its keep-alive
+# timeout from this setting. Gunicorn's default of 2 seconds closes idle
+# connections between chat messages, forcing a new TCP/TLS handshake for
+# almost every request, so keep them open longer than a user typically
+# pauses between messages.
+keepalive = 75
+
 timeout = 120
 
 
@@ -0,0 +1,8 @@
+import os
+from pathlib import Path
+
+# api.main builds the app at import time, which needs the required settings
+# and resolves the static files directory relative to src/
+os.environ.setdefault("AZURE_EXISTING_AIPROJECT_ENDPOINT", "https://example.services.ai.azure.com/api/projects/test")
+os.environ.setdefault("AZURE_AI_CHAT_DEPLOYMENT_NAME", "gpt-4o-mini")
+os.chdir(Path(__file__).parent.parent)
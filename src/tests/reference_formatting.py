@@ -0,0 +1,177 @@
+"""
+The original (pre-optimization) response formatting helpers, kept as a
+reference: the optimized versions in api/routes.py and api/code_format.py
+must produce exactly the same output.
+"""
+import re
+
+
+def clean_citation_markers(content: str) -> str:
+    """
+    Convert citation markers from Foundry IQ/knowledge base responses into 
+    functional footnote-style references.
+    
+    Citation markers look like: 【4:6†source】, 【4:0†MMC_P7_Safety.md】, etc.
+    These are converted to superscript references like [1], [2] with a 
+    sources list at the bottom.
+    
+    Args:
+        content: The raw response content with citation markers
+        
+    Returns:
+        str: Content with citation markers converted to footnotes
+    """
+    # Pattern matches: 【digits:digits†text】
+    # Examples: 【4:6†source】, 【4:0†MMC_P7_Safety_Program_Overview.md】
+    citation_pattern = r'【(\d+):(\d+)†([^】]*)】'
+    
+    # Find all citations and track unique sources
+    citations = re.findall(citation_pattern, content)
+    
+    if not citations:
+        return content
+    
+    # Build a map of unique sources to reference numbers
+    source_map = {}  # source_name -> reference_number
+    source_list = []  # ordered list of unique sources
+    
+    for doc_id, chunk_id, source_name in citations:
+        # Create a unique key for this source
+        source_key = source_name.strip()
+        if source_key and source_key not in source_map:
+            ref_num = len(source_list) + 1
+            source_map[source_key] = ref_num
+            source_list.append(source_key)
+    
+    # Replace citations with superscript-style references
+    def replace_citation(match):
+        doc_id, chunk_id, source_name = match.groups()
+        source_key = source_name.strip()
+        if source_key and source_key in source_map:
+            ref_num = source_map[source_key]
+            return f'<sup>[{ref_num}]</sup>'
+        return ''  # Remove if source is empty
+    
+    cleaned = re.sub(citation_pattern, replace_citation, content)
+    
+    # Clean up any double spaces left behind
+    cleaned = re.sub(r'  +', ' ', cleaned)
+    
+    # Add sources section at the bottom if we have any
+    if source_list:
+        sources_section = "\n\n---\n\n**📚 Sources:**\n"
+        for i, source in enumerate(source_list, 1):
+            # Clean up the source name for display
+            display_name = source.replace('_', ' ').replace('.md', '')
+            sources_section += f"\n[{i}] *{display_name}*"
+        cleaned += sources_section
+    
+    return cleaned
+
+
+def format_code_interpreter_output(content: str) -> str:
+    """
+    Detect and wrap raw code interpreter output in markdown code fences.
+    
+    Code interpreter output typically starts with import statements and
+    contains Python code that should be formatted nicely in the UI.
+    
+    Args:
+        content: The raw response content from the agent
+        
+    Returns:
+        str: Content with code interpreter blocks wrapped in ```python fences
+    """
+    lines = content.split('\n')
+    result_lines = []
+    code_block = []
+    in_code_block = False
+    
+    def is_code_line(line: str) -> bool:
+        """Check if a line looks like Python code."""
+        stripped = line.strip()
+        if not stripped:
+            return in_code_block  # Empty lines continue code blocks
+        
+        # NEVER treat markdown syntax as code
+        # Markdown headings (## Heading)
+        if re.match(r'^#{1,6}\s+\S', stripped):
+            return False
+        # Markdown images ![alt](url)
+        if re.match(r'^!\[.*?\]\(.*?\)$', stripped):
+            return False
+        # Base64 data URIs
+        if 'data:image/' in stripped:
+            return False
+        # Markdown bold/italic at start of line
+        if re.match(r'^\*{1,2}\w', stripped) or re.match(r'^_{1,2}\w', stripped):
+            return False
+        # Numbered lists with text (1. **Something**)
+        if re.match(r'^\d+\.\s+\*{0,2}\w', stripped):
+            return False
+        
+        # Definite code patterns - must be actual Python code
+        code_patterns = [
+            stripped.startswith(('import ', 'from ')),
+            # Python comments start with # followed by space, but exclude markdown headings
+            stripped.startswith('# ') and not re.match(r'^#\s+[A-Z][a-z]+', stripped),
+            stripped.startswith(('def ', 'class ', 'if ', 'for ', 'while ', 'with ', 'try:', 'except')),
+            '=' in stripped and not stripped.endswith(':') and not stripped.startswith(('**', '*', '-', '•')),
+            stripped.startswith(('plt.', 'img.', 'df.', 'np.', 'pd.')),
+            '/mnt/data/' in stripped,
+            re.match(r'^[a-z_][a-z0-9_]*\.[a-z_]+\(', stripped),  # method calls like img.size()
+            re.match(r'^[a-z_][a-z0-9_]*\(', stripped),  # function calls like print()
+        ]
+        return any(code_patterns)
+    
+    def is_prose_line(line: str) -> bool:
+        """Check if a line looks like natural language prose."""
+        stripped = line.strip()
+        if not stripped:
+            return False
+        # Prose typically starts with capital letter and contains spaces/words
+        if re.match(r'^[A-Z][a-z]+.*\s+\w+', stripped):
+            # But exclude things that look like code
+            if not any(c in stripped for c in ['(', ')', '=', '.', '/']):
+                return True
+            # Check if it's a sentence (ends with punctuation or contains common words)
+            if re.search(r'(the |is |are |a |an |this |that |hazard|visible|image|worker)', stripped, re.IGNORECASE):
+                return True
+        # Bullet points are prose
+        if stripped.startswith(('- ', '* ', '• ')):
+            return True
+        return False
+    
+    for line in lines:
+        if is_prose_line(line) and in_code_block:
+            # End the code block
+            if code_block:
+                result_lines.append('```python')
+                result_lines.extend(code_block)
+                result_lines.append('```')
+                code_block = []
+            in_code_block = False
+            result_lines.append(line)
+        elif is_code_line(line):
+            in_code_block = True
+            code_block.append(line)
+        elif in_code_block and line.strip():
+            # Continue code block with non-empty lines that might be code
+            code_block.append(line)
+        else:
+            if in_code_block and code_block:
+                # End code block on empty line if we have content
+                result_lines.append('```python')
+                result_lines.extend(code_block)
+                result_lines.append('```')
+                code_block = []
+                in_code_block = False
+            result_lines.append(line)
+    
+    # Handle any remaining code block
+    if code_block:
+        result_lines.append('```python')
+        result_lines.extend(code_block)
+        result_lines.append('```')
+    
+    return '\n'.join(result_lines)
@@ -0,0 +1,309 @@
+import asyncio
+import dataclasses
+import os
+from types import SimpleNamespace
+
+import fastapi
+import pytest
+from fastapi.staticfiles import StaticFiles
+from fastapi.testclient import TestClient
+from azure.core.credentials import AccessToken
+from azure.core.exceptions import ServiceRequestError
+
+from api import main
+
+
+def test_find_sync_handlers_reports_sync_endpoint_in_included_router():
+    router = fastapi.APIRouter()
+
+    def sync_dependency():
+        return 1
+
+    @router.get("/sync")
+    def sync_endpoint(value=fastapi.Depends(sync_dependency)):
+        return value
+
+    @router.get("/async")
+    async def async_endpoint():
+        return 1
+
+    app = fastapi.FastAPI()
+    app.include_router(router)
+
+    assert main.find_sync_handlers(app) == [
+        "/sync: endpoint sync_endpoint",
+        "/sync: dependency sync_dependency",
+    ]
+
+
+def test_find_sync_handlers_accepts_app_routes():
+    assert main.find_sync_handlers(main.app) == []
+
+
+def test_resolve_agent_retries_after_failed_fetch(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "CONFIG_HASH_FILE", tmp_path / ".agent_config_hash")
+    agent = SimpleNamespace(id="agent-id", name="agent", version="3")
+    calls = []
+
+    def get(agent_name):
+        calls.append(agent_name)
+        if len(calls) == 1:
+            raise ServiceRequestError("connection reset")
+        return agent
+
+    project_client = SimpleNamespace(agents=SimpleNamespace(get=get))
+    ctx = main.AppContext(project_client=project_client, openai_client=None, agent_name="agent")
+
+    async def scenario():
+        ctx.start_agent_fetch({"hash": "abc"})
+        with pytest.raises(ServiceRequestError):
+            await ctx.resolve_agent()
+        return await ctx.resolve_agent()
+
+    assert asyncio.run(scenario()) is agent
+    assert calls == ["agent", "agent"]
+    assert ctx.agent is agent
+    assert main.get_stored_config_state()["agent_info"]["version"] == "3"
+
+
+def test_lifespan_closes_resources_when_startup_fails(monkeypatch):
+    closed = []
+
+    class Closeable:
+        def __init__(self, name, **kwargs):
+            self.name = name
+
+        def close(self):
+            closed.append(self.name)
+
+    async def create_async_openai_client(credential, endpoint):
+        raise ServiceRequestError("connection reset")
+
+    monkeypatch.setattr(main, "create_http_session", lambda: Closeable("http_session"))
+    monkeypatch.setattr(main, "AIProjectClient", lambda **kwargs: Closeable("project_client"))
+    monkeypatch.setattr(main, "create_async_openai_client", create_async_openai_client)
+
+    app = fastapi.FastAPI()
+    app.state.settings = dataclasses.replace(main.app.state.settings, config_source="local")
+    app.state.credential_factory = lambda: Closeable("credential")
+
+    async def scenario():
+        async with main.Lifespan(app):
+            pass
+
+    with pytest.raises(ServiceRequestError):
+        asyncio.run(scenario())
+    assert closed == ["project_client", "http_session", "credential"]
+
+
+@pytest.fixture
+def static_client(monkeypatch, tmp_path):
+    (tmp_path / "styles.css").write_text("body { color: red; }\n" * 200)
+    monkeypatch.setattr(main, "STATIC_DIR", tmp_path)
+    app = fastapi.FastAPI()
+    main.add_preloaded_static_route(app, StaticFiles(directory=tmp_path))
+    return TestClient(app)
+
+
+def test_static_asset_is_gzipped_with_its_own_etag(static_client):
+    plain = static_client.get("/static/styles.css", headers={"Accept-Encoding": "identity"})
+    gzipped = static_client.get("/static/styles.css", headers={"Accept-Encoding": "gzip, br"})
+    assert "content-encoding" not in plain.headers
+    assert gzipped.headers["content-encoding"] == "gzip"
+    assert gzipped.text == plain.text
+    assert gzipped.headers["etag"] != plain.headers["etag"]
+    assert gzipped.headers["vary"] == "Accept-Encoding"
+
+
+@pytest.mark.parametrize("accept_encoding", ["gzip;q=0", "br, gzip; q=0.0", "*;q=0", ""])
+def test_static_asset_is_not_gzipped_when_refused(static_client, accept_encoding):
+    response = static_client.get("/static/styles.css", headers={"Accept-Encoding": accept_encoding})
+    assert "content-encoding" not in response.headers
+
+
+@pytest.mark.parametrize("accept_encoding", ["gzip;q=0.5", "*", "identity, *;q=0.1"])
+def test_static_asset_is_gzipped_when_accepted(static_client, accept_encoding):
+    response = static_client.get("/static/styles.css", headers={"Accept-Encoding": accept_encoding})
+    assert response.headers["content-encoding"] == "gzip"
+
+
+def test_static_asset_if_none_match(static_client):
+    headers = {"Accept-Encoding": "identity"}
+    etag = static_client.get("/static/styles.css", headers=headers).headers["etag"]
+    for if_none_match in (etag, f"W/{etag}", f'"other", {etag}', "*"):
+        response = static_client.get("/static/styles.css", headers={**headers, "If-None-Match": if_none_match})
+        assert response.status_code == 304
+        assert response.headers["etag"] == etag
+    response = static_client.get("/static/styles.css", headers={**headers, "If-None-Match": '"other"'})
+    assert response.status_code == 200
+
+
+# =============================================================================
+# CONFIG STATE (FAST AND SLOW STARTUP PATHS)
+# =============================================================================
+
+class FakeAgents:
+    def __init__(self, calls):
+        self.calls = calls
+
+    def get(self, agent_name):
+        self.calls.append("get")
+        return SimpleNamespace(id="agent-id", name=agent_name, version="1")
+
+    def create_version(self, agent_name, definition, description):
+        self.calls.append("create_version")
+        return SimpleNamespace(id="agent-id", name=agent_name, version="2")
+
+
+class FakeClosable:
+    def close(self):
+        pass
+
+
+class FakeAsyncClosable:
+    async def close(self):
+        pass
+
+
+@pytest.fixture
+def start_local(monkeypatch, tmp_path):
+    """Run a local-mode startup against config files in tmp_path."""
+    (tmp_path / "system.txt").write_text("You are a test agent.")
+    (tmp_path / "agent.yaml").write_text("tools: {}\n")
+    monkeypatch.setattr(main, "SYSTEM_PROMPT_FILE", tmp_path / "system.txt")
+    monkeypatch.setattr(main, "AGENT_CONFIG_FILE", tmp_path / "agent.yaml")
+    monkeypatch.setattr(main, "CONFIG_HASH_FILE", tmp_path / ".agent_config_hash")
+
+    calls = []
+
+    async def create_async_openai_client(credential, endpoint):
+        return FakeAsyncClosable()
+
+    monkeypatch.setattr(main, "create_http_session", FakeClosable)
+    monkeypatch.setattr(
+        main, "AIProjectClient",
+        lambda **kwargs: SimpleNamespace(agents=FakeAgents(calls), close=lambda: None),
+    )
+    monkeypatch.setattr(main, "create_async_openai_client", create_async_openai_client)
+
+    app = fastapi.FastAPI()
+    app.state.settings = dataclasses.replace(main.app.state.settings, config_source="local")
+    app.state.credential_factory = FakeClosable
+
+    def start():
+        calls.clear()
+
+        async def scenario():
+            async with main.Lifespan(app):
+                return await app.state.ctx.resolve_agent()
+
+        agent = asyncio.run(scenario())
+        return list(calls), agent
+
+    return start
+
+
+def test_startup_creates_agent_on_first_run(start_local):
+    calls, agent = start_local()
+    assert calls == ["create_version"]
+    assert agent.version == "2"
+    state = main.get_stored_config_state()
+    assert state["sys_mtime"] == main.SYSTEM_PROMPT_FILE.stat().st_mtime_ns
+    assert state["agent_info"]["version"] == "2"
+
+
+def test_startup_fast_path_uses_stored_agent(start_local):
+    start_local()
+    calls, agent = start_local()
+    assert calls == []
+    assert isinstance(agent, main.StoredAgent)
+    assert agent.version == "2"
+
+
+def test_startup_slow_path_reuses_agent_when_content_unchanged(start_local):
+    start_local()
+    st = main.SYSTEM_PROMPT_FILE.stat()
+    os.utime(main.SYSTEM_PROMPT_FILE, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+    calls, agent = start_local()
+    assert calls == []
+    assert agent.version == "2"
+    # The new mtime is stored, so the next startup takes the fast path again
+    assert main.get_stored_config_state()["sys_mtime"] == st.st_mtime_ns + 1_000_000_000
+
+
+def test_startup_creates_new_version_when_content_changed(start_local):
+    start_local()
+    main.SYSTEM_PROMPT_FILE.write_text("You are a different test agent.")
+    calls, _ = start_local()
+    assert calls == ["create_version"]
+
+
+def test_startup_fetches_agent_when_state_has_none(start_local):
+    start_local()
+    state = main.get_stored_config_state()
+    del state["agent_info"]
+    main.store_config_state(state)
+
+    calls, agent = start_local()
+    assert calls == ["get"]
+    assert agent.version == "1"
+    assert main.get_stored_config_state()["agent_info"]["version"] == "1"
+
+
+@pytest.mark.parametrize("content", [b"{not json", b"[1, 2]", b"\xff"])
+def test_startup_treats_unreadable_state_as_first_run(start_local, content):
+    start_local()
+    main.CONFIG_HASH_FILE.write_bytes(content)
+    assert main.get_stored_config_state() == {}
+    calls, _ = start_local()
+    assert calls == ["create_version"]
+
+
+def test_missing_state_file_reads_as_empty(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "CONFIG_HASH_FILE", tmp_path / ".agent_config_hash")
+    assert main.get_stored_config_state() == {}
+    main.store_config_state({"hash": "abc"})
+    assert main.get_stored_config_state() == {"hash": "abc"}
+    assert [path.name for path in tmp_path.iterdir()] == [".agent_config_hash"]
+
+
+# =============================================================================
+# TOKEN CACHE
+# =============================================================================
+
+class FakeCredential:
+    def __init__(self, lifetime):
+        self.lifetime = lifetime
+        self.calls = 0
+
+    def get_token(self, *scopes, **kwargs):
+        self.calls += 1
+        return AccessToken(f"token-{self.calls}", int(main.time.time()) + self.lifetime)
+
+
+def test_caching_credential_reuses_token_until_near_expiry(monkeypatch):
+    now = 1_000_000.0
+    monkeypatch.setattr(main.time, "time", lambda: now)
+    inner = FakeCredential(lifetime=3600)
+    credential = main.CachingTokenCredential(inner)
+
+    assert credential.get_token("scope").token == "token-1"
+    now += 3600 - main.TOKEN_REFRESH_MARGIN_SECONDS - 1
+    assert credential.get_token("scope").token == "token-1"
+    assert credential.get_cached_token("scope").token == "token-1"
+
+    # Within the refresh margin the cached token is no longer handed out
+    now += 1
+    assert credential.get_cached_token("scope") is None
+    assert credential.get_token("scope").token == "token-2"
+    assert inner.calls == 2
+
+
+def test_caching_credential_bypasses_cache_for_claims_and_other_scopes():
+    inner = FakeCredential(lifetime=3600)
+    credential = main.CachingTokenCredential(inner)
+    credential.get_token("scope")
+    assert credential.get_token("scope", claims="challenge").token == "token-2"
+    assert credential.get_token("other").token == "token-3"
+    assert credential.get_token("scope").token == "token-1"
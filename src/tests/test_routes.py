@@ -0,0 +1,174 @@
+import base64
+import random
+from types import SimpleNamespace
+
+import fastapi
+import openai
+import pytest
+from fastapi.testclient import TestClient
+
+from api import routes
+from api.main import AppContext
+from api.util import ChatRequest, ResponseCache
+
+from . import reference_formatting
+
+
+class FakeStream:
+    def __init__(self, events):
+        self._events = iter(events)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._events)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakeResponses:
+    def __init__(self):
+        self.inputs = []
+
+    async def create(self, **kwargs):
+        self.inputs.append(kwargs["input"])
+        return FakeStream([SimpleNamespace(type="response.output_text.done", text="ok")])
+
+
+class FakeFiles:
+    def __init__(self, failing_name=None):
+        self.failing_name = failing_name
+        self.uploads = []
+
+    async def create(self, file, purpose):
+        self.uploads.append(file[0])
+        if file[0] == self.failing_name:
+            raise openai.APIConnectionError(request=None)
+        return SimpleNamespace(id=f"file-{len(self.uploads)}")
+
+
+def make_client(files=None, **ctx_fields):
+    openai_client = SimpleNamespace(responses=FakeResponses(), files=files or FakeFiles())
+    app = fastapi.FastAPI()
+    app.include_router(routes.router)
+    app.state.ctx = AppContext(
+        project_client=None,
+        openai_client=openai_client,
+        agent_name="agent",
+        chat_extra_body={},
+        agent=SimpleNamespace(name="agent"),
+        agent_version="1",
+        **ctx_fields,
+    )
+    return TestClient(app), openai_client
+
+
+# =============================================================================
+# RESPONSE CACHE
+# =============================================================================
+
+def chat_request(*contents):
+    return ChatRequest(messages=[{"content": content} for content in contents])
+
+
+def test_response_cache_key_covers_conversation_and_agent_version():
+    key = routes.response_cache_key(chat_request("hi", "there"), "agent", "1")
+    assert key == routes.response_cache_key(chat_request("hi", "there"), "agent", "1")
+    assert key != routes.response_cache_key(chat_request("hi", "there"), "agent", "2")
+    assert key != routes.response_cache_key(chat_request("hi", "there"), "other", "1")
+    assert key != routes.response_cache_key(chat_request("hi there"), "agent", "1")
+    assert key != routes.response_cache_key(chat_request("hi"), "agent", "1")
+
+
+# =============================================================================
+# REQUEST SIZE LIMIT
+# =============================================================================
+
+def test_chat_body_over_the_limit_is_rejected(monkeypatch):
+    monkeypatch.setattr(routes, "MAX_CHAT_REQUEST_SIZE", 100)
+    client, openai_client = make_client()
+    body = b'{"messages": [{"content": "' + b"x" * 100 + b'"}]}'
+
+    assert client.post("/chat", content=body).status_code == 413
+    # Without a Content-Length, the body is counted while it is read
+    assert client.post("/chat", content=iter([body[:60], body[60:]])).status_code == 413
+    assert openai_client.responses.inputs == []
+
+    assert client.post("/chat", content=b'{"messages": [{"content": "hi"}]}').status_code == 200
+
+
+# =============================================================================
+# RESPONSE FORMATTING
+# =============================================================================
+
+FORMATTING_SAMPLES = [
+    "",
+    "Just a plain answer.",
+    "Here is the chart:\nimport matplotlib.pyplot as plt\nplt.plot(x, y)\n\nThe chart shows the trend.",
+    "## Results\n1. **First** item\n- a bullet\nx = 1\ny = 2\nThe worker is visible in this image.",
+    "Safety first 【4:6†MMC_P7_Safety.md】 and again 【4:7†MMC_P7_Safety.md】  done 【1:2† 】.",
+    "Broken marker 【4:6†never closed",
+    "![image](/mnt/data/chart.png)\n# Compute\nfor i in range(3):\n    print(i)",
+]
+
+FORMATTING_TOKENS = [
+    "#", "##", " ", "\t", "!", "[", "]", "(", ")", "*", "_", "1", ".", "a", "Ab", "The ", "x", "=",
+    ":", "import ", "from ", "img.", "é", "\n", "\n", "\n  \n", "- ", "/mnt/data/", "for ", "if ",
+    "try:", "except", "def ", "np.", "/", "the ", "Worker", "【1:2†a.md】", "【3:4† 】",
+]
+
+
+def formatting_inputs():
+    rng = random.Random(6)
+    yield from FORMATTING_SAMPLES
+    for _ in range(5000):
+        yield "".join(rng.choice(FORMATTING_TOKENS) for _ in range(rng.randint(0, 30)))
+
+
+def test_formatting_matches_reference_implementation():
+    for content in formatting_inputs():
+        assert routes.format_code_interpreter_output(content) == \
+            reference_formatting.format_code_interpreter_output(content), repr(content)
+        assert routes.clean_citation_markers(content) == \
+            reference_formatting.clean_citation_markers(content), repr(content)
+
+
+# =============================================================================
+# ATTACHMENT UPLOADS
+# =============================================================================
+
+def attachment(name, mime_type, data):
+    return {"name": name, "type": mime_type, "data": data}
+
+
+def test_attachment_is_sent_inline_when_upload_fails():
+    files = FakeFiles(failing_name="bad.pdf")
+    client, openai_client = make_client(
+        files=files,
+        uploaded_files=ResponseCache(4),
+        attachment_upload_min_size=10,
+    )
+    data = base64.b64encode(b"x" * 100).decode()
+    body = {"messages": [{"content": "hi", "attachments": [
+        attachment("good.pdf", "application/pdf", data),
+        attachment("bad.pdf", "application/pdf", data),
+        attachment("invalid.pdf", "application/pdf", "!" * 20),
+        attachment("small.txt", "text/plain", "QUJD"),
+    ]}]}
+
+    assert client.post("/chat", json=body).status_code == 200
+    # Invalid base64 is never uploaded, and small attachments are always inline
+    assert files.uploads == ["good.pdf", "bad.pdf"]
+    assert openai_client.responses.inputs[-1][0]["content"] == [
+        {"type": "input_text", "text": "hi"},
+        {"type": "input_file", "file_id": "file-1"},
+        {"type": "input_file", "file_data": f"data:application/pdf;base64,{data}", "filename": "bad.pdf"},
+        {"type": "input_file", "file_data": "data:application/pdf;base64," + "!" * 20, "filename": "invalid.pdf"},
+        {"type": "input_file", "file_data": "data:text/plain;base64,QUJD", "filename": "small.txt"},
+    ]
+
+    # The successful upload is reused; the failed one is tried again
+    assert client.post("/chat", json=body).status_code == 200
+    assert files.uploads == ["good.pdf", "bad.pdf", "bad.pdf"]
@@ -0,0 +1,41 @@
+import pydantic
+import pytest
+
+from api.util import ChatRequest, FileAttachment, ResponseCache
+
+
+def test_attachment_with_data():
+    attachment = FileAttachment(name="a.png", type="image/png", data="QUJD")
+    assert attachment.url is None
+
+
+def test_attachment_with_url():
+    attachment = FileAttachment(name="a.png", type="image/png", url="https://example.com/a.png")
+    assert attachment.data == ""
+
+
+def test_attachment_without_data_or_url_is_rejected():
+    with pytest.raises(pydantic.ValidationError):
+        FileAttachment(name="a.png", type="image/png")
+
+
+def test_attachment_with_data_and_url_is_rejected():
+    with pytest.raises(pydantic.ValidationError):
+        FileAttachment(name="a.png", type="image/png", data="QUJD", url="https://example.com/a.png")
+
+
+def test_chat_request_with_empty_attachment_is_rejected():
+    body = '{"messages": [{"content": "hi", "attachments": [{"name": "a.png", "type": "image/png"}]}]}'
+    with pytest.raises(pydantic.ValidationError):
+        ChatRequest.model_validate_json(body)
+
+
+def test_response_cache_evicts_least_recently_used():
+    cache = ResponseCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3